@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Bulk insert benchmark.
+
+Loads rows into a Model with List.append, one INSERT per row, and with
+List.bulk_insert, one multi row INSERT per chunk, each in a fresh
+process so no path runs on the heap left by another. The database is
+a stub counting statements, so the numbers show the ORM and statement
+building cost; on a real server every statement saved is also a round
+trip saved.
+
+    python benchmarks/model_bulk.py [rows]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import subprocess
+
+from tachyonic.neutrino.model import Model
+
+
+class Database(object):
+    def __init__(self):
+        self.statements = 0
+        self._rows = 0
+
+    def execute(self, query, values=None):
+        self.statements += 1
+        self._rows = query.count('),(') + 1
+        return []
+
+    def last_row_id(self):
+        return self.statements
+
+    def last_row_count(self):
+        return self._rows
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class User(Model):
+    name = Model.Text()
+    email = Model.Email()
+    score = Model.Integer()
+
+    class Meta:
+        db_table = 'user'
+
+
+def rows(count):
+    return [{'name': 'user %d' % i,
+             'email': 'user%d@example.com' % i,
+             'score': i} for i in range(count)]
+
+
+def append(data):
+    db = Database()
+    users = User(db=db)
+    for row in data:
+        users.append(row)
+    return db.statements
+
+
+def bulk(data, chunk_size):
+    db = Database()
+    users = User(db=db)
+    users.bulk_insert(data, chunk_size=chunk_size)
+    return db.statements
+
+
+def run(name, count):
+    data = rows(count)
+    start = time.time()
+    if name == 'append':
+        statements = append(data)
+    else:
+        statements = bulk(data, int(name.split('=')[1]))
+    print("%-24s %8d %12d %10.2f" % (name, count, statements,
+                                     time.time() - start))
+
+
+def main(count=50000):
+    print("%-24s %8s %12s %10s" % ('path', 'rows', 'statements', 'seconds'))
+    for name in ('append', 'bulk_insert chunk=100', 'bulk_insert chunk=1000'):
+        subprocess.check_call([sys.executable, __file__, '--run', name,
+                               str(count)])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3 and sys.argv[1] == '--run':
+        run(sys.argv[2], int(sys.argv[3]))
+    elif len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compact row memory benchmark.
+
+Loads ROWS rows with List.query and List.query(compact=True) from a stub
+database, each in a fresh process, reporting the peak resident memory
+and the time taken. The rows mode only builds the result the database
+would return, which both other modes include.
+
+    python benchmarks/model_compact.py [rows]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import resource
+import subprocess
+
+from tachyonic.neutrino.model import Model
+
+
+class Database(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, values=None):
+        return self.rows
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class User(Model):
+    name = Model.Text()
+    email = Model.Email()
+    score = Model.Integer()
+    city = Model.Text()
+    country = Model.Text()
+
+    class Meta:
+        db_table = 'user'
+
+
+def rows(count):
+    return [{'id': i,
+             'name': 'user %d' % i,
+             'email': 'user%d@example.com' % i,
+             'score': i,
+             'city': 'Cape Town',
+             'country': 'ZA'} for i in range(count)]
+
+
+def peak():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+    return peak / 1024.0
+
+
+def run(mode, count):
+    data = rows(count)
+    start = time.time()
+    if mode != 'rows':
+        users = User(db=Database(data))
+        users.query(compact=mode == 'compact')
+    print("%-10s %10d %12.1f %10.2f" % (mode, count, peak(),
+                                         time.time() - start))
+
+
+def main(count=100000):
+    print("%-10s %10s %12s %10s" % ('mode', 'rows', 'peak MB', 'seconds'))
+    for mode in ('rows', 'query', 'compact'):
+        subprocess.check_call([sys.executable, __file__, '--run', mode,
+                               str(count)])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3 and sys.argv[1] == '--run':
+        run(sys.argv[2], int(sys.argv[3]))
+    elif len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
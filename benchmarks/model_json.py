@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Model JSON benchmark.
+
+Encodes a Model list with dump_json() and iter_json() and compares them
+with the JSONEncoder subclass used before, which was called back for
+every Field. Decoding compares json.loads with the C scanner against the
+decoder forcing the pure Python scanner, which load_json() used.
+
+    python benchmarks/model_json.py [rows]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import json
+from datetime import datetime
+
+from tachyonic.neutrino.model import Model
+from tachyonic.neutrino.model import Fields
+
+
+class LegacyEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o.value(), datetime):
+            return str(o.value().strftime("%Y/%m/%d %H:%M:%S"))
+        elif isinstance(o, Fields.JsonObject):
+            if o.value() is not None and o.value().strip() != '':
+                return json.loads(o.value())
+        else:
+            return o.value()
+
+
+class LegacyDecoder(json.JSONDecoder):
+    def __init__(self, **kwargs):
+        json.JSONDecoder.__init__(self, **kwargs)
+        self.scan_once = json.scanner.py_make_scanner(self)
+
+
+class User(Model):
+    name = Model.Text()
+    email = Model.Email()
+    score = Model.Integer()
+    created = Model.Datetime()
+    settings = Model.JsonObject()
+    password = Model.Password()
+
+
+def users(count):
+    users = User()
+    for i in range(count):
+        users.append({'name': 'user %d' % i,
+                      'email': 'user%d@example.com' % i,
+                      'score': i,
+                      'created': datetime(2016, 1, 1, 12, 0, i % 60),
+                      'settings': '{"theme": "dark", "rows": %d}' % i,
+                      'password': '$2b$15$' + 'x' * 53}, False)
+    return users
+
+
+def timed(name, count, test, repeat=3):
+    duration = None
+    for i in range(repeat):
+        start = time.time()
+        size = test()
+        took = time.time() - start
+        if duration is None or took < duration:
+            duration = took
+    print("%-16s %8d %10d %10.3f %12.0f" % (name, count, size, duration,
+                                            count / duration))
+
+
+def main(count=10000):
+    data = users(count)
+    print("%-16s %8s %10s %10s %12s" % ('path', 'rows', 'bytes', 'seconds',
+                                        'rows/s'))
+    timed('encode legacy', count,
+          lambda: len(json.dumps(data, cls=LegacyEncoder)))
+    timed('dump_json', count, lambda: len(data.dump_json()))
+    timed('iter_json', count,
+          lambda: sum(len(chunk) for chunk in data.iter_json()))
+    timed('dump_json indent', count, lambda: len(data.dump_json(indent=1)))
+
+    raw = data.dump_json()
+    timed('decode legacy', count,
+          lambda: len(json.loads(raw, cls=LegacyDecoder)))
+    timed('decode', count, lambda: len(json.loads(raw)))
+    loads = json.loads(raw)
+    for row in loads:
+        # Passwords are left out of the output.
+        del row['password']
+    raw = json.dumps(loads)
+
+    def load():
+        users = User()
+        users.load_json(raw)
+        return len(users)
+    timed('load_json', count, load)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Model construction benchmark.
+
+Builds Model lists of 10k and 100k rows with List.append, without a
+database, and with List.query from a stub database returning the rows.
+Both paths construct a Dict and copy its fields for every row, so the
+numbers show the per row cost of field handling. Each path runs with
+and without the cyclic garbage collector, whose passes over the growing
+heap dominate the larger runs.
+
+    python benchmarks/model_rows.py [rows ...]
+"""
+from __future__ import print_function
+
+import gc
+import sys
+import time
+
+from tachyonic.neutrino.model import Model
+
+
+class Database(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, values=None):
+        return self.rows
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class User(Model):
+    name = Model.Text()
+    email = Model.Email()
+    score = Model.Integer()
+    city = Model.Text()
+    country = Model.Text()
+
+    class Meta:
+        db_table = 'user'
+
+
+def rows(count):
+    return [{'name': 'user %d' % i,
+             'email': 'user%d@example.com' % i,
+             'score': i,
+             'city': 'Cape Town',
+             'country': 'ZA'} for i in range(count)]
+
+
+def append(data):
+    users = User()
+    for row in data:
+        users.append(row)
+    return len(users)
+
+
+def query(data):
+    data = [dict(row, id=i) for i, row in enumerate(data)]
+    users = User(db=Database(data))
+    users.query()
+    return len(users)
+
+
+def main(counts=(10000, 100000)):
+    print("%-10s %4s %8s %10s %12s" % ('path', 'gc', 'rows', 'seconds',
+                                       'rows/s'))
+    for count in counts:
+        data = rows(count)
+        for name, test in (('append', append), ('query', query)):
+            for collect in (True, False):
+                gc.collect()
+                if collect is False:
+                    gc.disable()
+                try:
+                    start = time.time()
+                    built = test(data)
+                    duration = time.time() - start
+                finally:
+                    gc.enable()
+                print("%-10s %4s %8d %10.2f %12.0f" % (name,
+                                                       collect and 'on' or 'off',
+                                                       built, duration,
+                                                       built / duration))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([int(count) for count in sys.argv[1:]])
+    else:
+        main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Result set memory benchmark.
+
+Fills a scratch table with ROWS rows and reads it back with Mysql.execute,
+Mysql.stream and Mysql.stream(tuples=True), each in a fresh process,
+reporting the peak resident memory and the time taken. Requires a MySQL
+server; the connection is taken from the environment:
+
+    MYSQL_HOST=localhost MYSQL_USER=root MYSQL_PASSWORD= \\
+    MYSQL_DATABASE=test python benchmarks/mysql_stream.py [rows]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import resource
+import subprocess
+
+TABLE = 'neutrino_benchmark_stream'
+BATCH = 10000
+
+
+def db():
+    from tachyonic.neutrino.mysql import Mysql
+
+    return Mysql('benchmark',
+                 host=os.environ.get('MYSQL_HOST', 'localhost'),
+                 username=os.environ.get('MYSQL_USER', 'root'),
+                 password=os.environ.get('MYSQL_PASSWORD', ''),
+                 database=os.environ.get('MYSQL_DATABASE', 'test'))
+
+
+def fill(rows):
+    conn = db()
+    conn.execute("DROP TABLE IF EXISTS %s" % (TABLE,))
+    conn.execute("CREATE TABLE %s (id INT PRIMARY KEY, name VARCHAR(64)," %
+                 (TABLE,) + " email VARCHAR(128), score DOUBLE)")
+    for start in range(0, rows, BATCH):
+        values = []
+        params = []
+        for i in range(start, min(start + BATCH, rows)):
+            values.append("(%s, %s, %s, %s)")
+            params.extend((i, 'name %d' % i, 'user%d@example.com' % i,
+                           i * 0.5))
+        conn.execute("INSERT INTO %s VALUES %s" % (TABLE, ", ".join(values)),
+                     params)
+    conn.commit()
+
+
+def run(mode):
+    conn = db()
+    query = "SELECT id, name, email, score FROM %s" % (TABLE,)
+    start = time.time()
+    count = 0
+    if mode == 'execute':
+        for row in conn.execute(query):
+            count += 1
+    elif mode == 'stream':
+        for row in conn.stream(query, batch_size=BATCH):
+            count += 1
+    else:
+        for row in conn.stream(query, batch_size=BATCH, tuples=True):
+            count += 1
+    duration = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+    print("%-16s %10d %12.1f %10.2f" % (mode, count, peak / 1024.0,
+                                         duration))
+
+
+def main(rows=1000000):
+    fill(rows)
+    print("%-16s %10s %12s %10s" % ('mode', 'rows', 'peak MB', 'seconds'))
+    try:
+        for mode in ('execute', 'stream', 'stream tuples'):
+            subprocess.check_call([sys.executable, __file__, '--run', mode])
+    finally:
+        conn = db()
+        conn.execute("DROP TABLE IF EXISTS %s" % (TABLE,))
+        conn.commit()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--run':
+        run(sys.argv[2])
+    elif len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
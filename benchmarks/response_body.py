@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Response body benchmark.
+
+Writes 1KB, 1MB and 50MB bodies into a Response, in one write and in 4KB
+writes, and consumes them as a WSGI server would. Compares the chunk list
+body, with and without chunk_size, against the StringIO body used
+before, which was read back in full.
+
+    python benchmarks/response_body.py
+"""
+from __future__ import print_function
+
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+from tachyonic.neutrino.response import Response
+
+SIZES = (('1KB', 1024), ('1MB', 1024 * 1024), ('50MB', 50 * 1024 * 1024))
+WRITE = 4096
+
+
+class LegacyResponse(Response):
+    def __init__(self):
+        Response.__init__(self)
+        object.__setattr__(self, '_legacy', StringIO())
+
+    def write(self, data):
+        object.__setattr__(self, 'content_length',
+                           self.content_length + len(data))
+        self._legacy.write(data)
+
+    def chunks(self):
+        self._legacy.seek(0)
+        return [self._legacy.read()]
+
+
+def consume(body):
+    sent = 0
+    for chunk in body:
+        sent += len(chunk)
+    return sent
+
+
+def run(factory, writes):
+    resp = factory()
+    for data in writes:
+        resp.write(data)
+    return consume(resp.chunks())
+
+
+def timed(factory, writes, total):
+    repeat = max(1, min(1000, (64 * 1024 * 1024) // total))
+    best = None
+    for i in range(3):
+        start = time.time()
+        for j in range(repeat):
+            run(factory, writes)
+        took = (time.time() - start) / repeat
+        if best is None or took < best:
+            best = took
+    return best
+
+
+def main():
+    bodies = [('legacy', LegacyResponse),
+              ('chunks', Response),
+              ('chunk 64KB', lambda: Response(chunk_size=65536))]
+    print("%-6s %-8s %-12s %12s %10s" % ('body', 'writes', 'response',
+                                         'ms', 'MB/s'))
+    for label, size in SIZES:
+        data = b'x' * size
+        pieces = [data[i:i + WRITE] for i in range(0, size, WRITE)]
+        for writes_label, writes in (('single', [data]), ('4KB', pieces)):
+            for name, factory in bodies:
+                took = timed(factory, writes, size)
+                print("%-6s %-8s %-12s %12.3f %10.0f" % (
+                    label, writes_label, name, took * 1000,
+                    size / took / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
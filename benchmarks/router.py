@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Router lookup benchmark.
+
+Registers 10 to 10,000 routes and times the registration as well as the
+lookup of the first, middle and last registered route. With the compiled
+segment trie the cost per lookup depends on the depth of the path, not on
+the number of routes.
+
+    python benchmarks/router.py
+"""
+from __future__ import print_function
+
+import timeit
+
+from tachyonic.neutrino.router import Router
+
+SIZES = (10, 100, 1000, 10000)
+LOOKUPS = 20000
+
+
+def _view(req, resp, **kwargs):
+    pass
+
+
+def build(size):
+    router = Router()
+    for i in range(size):
+        router.add('GET', '/resource%d/{id}/detail' % i, _view)
+        router.add('POST', '/resource%d' % i, _view)
+    return router
+
+
+def main():
+    print("%-8s %s" % ('routes', 'msec/registration'))
+    for size in SIZES:
+        seconds = min(timeit.repeat(lambda: build(size), number=1, repeat=3))
+        print("%-8d %.3f" % (size, seconds * 1000))
+
+    print("")
+    print("%-8s %-10s %s" % ('routes', 'position', 'usec/lookup'))
+    for size in SIZES:
+        router = build(size)
+        for position in (0, size // 2, size - 1):
+            uri = 'resource%d/1234/detail' % position
+            seconds = min(timeit.repeat(lambda: router._match('GET', uri),
+                                        number=LOOKUPS, repeat=3))
+            print("%-8d %-10d %.3f" % (size, position,
+                                       seconds / LOOKUPS * 1000000))
+
+
+if __name__ == '__main__':
+    main()
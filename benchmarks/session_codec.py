@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Session codec benchmark.
+
+Encodes and decodes realistic session payloads with every available codec
+and reports the cost per operation and the encoded size. The old format,
+pickle protocol 0, is included for comparison.
+
+    python benchmarks/session_codec.py
+"""
+from __future__ import print_function
+
+import pickle
+import timeit
+from datetime import datetime
+
+from tachyonic.neutrino import codec
+
+NUMBER = 5000
+
+LOGIN = {'user_id': 1234,
+         'username': u'chris',
+         'email': u'chris@example.com',
+         'admin': True,
+         'roles': [u'admin', u'operator', u'user'],
+         'tenant': {u'id': 42, u'name': u'Acme Corporation'},
+         'login': datetime(2017, 3, 1, 12, 30, 15),
+         'token': u'a3f8c2d7e1b9406a8d5c3e2f1a0b9c8d'}
+
+CART = dict(LOGIN)
+CART['cart'] = [{u'sku': u'SKU-%05d' % i,
+                 u'name': u'Product number %d' % i,
+                 u'quantity': i % 5 + 1,
+                 u'price': 9.99 + i,
+                 u'gift': i % 2 == 0} for i in range(50)]
+CART['history'] = [u'/products/%d' % i for i in range(100)]
+
+
+class _Legacy(object):
+    tag = b'?'
+
+    def dumps(self, value):
+        return pickle.dumps(value, 0)
+
+    def loads(self, raw):
+        return pickle.loads(raw)
+
+
+def main():
+    codecs = [('pickle (protocol 0)', _Legacy())]
+    for name in sorted(codec.codecs):
+        try:
+            codecs.append((name, codec.get(name)))
+        except Exception as e:
+            print("Skipping %s: %s" % (name, e))
+
+    print("%-8s %-20s %8s %12s %12s" % ('payload', 'codec', 'bytes',
+                                        'encode usec', 'decode usec'))
+    for payload_name, payload in (('login', LOGIN), ('cart', CART)):
+        for name, c in codecs:
+            raw = c.dumps(payload)
+            encode = min(timeit.repeat(lambda: c.dumps(payload),
+                                       number=NUMBER, repeat=3))
+            decode = min(timeit.repeat(lambda: c.loads(raw),
+                                       number=NUMBER, repeat=3))
+            print("%-8s %-20s %8d %12.2f %12.2f" %
+                  (payload_name, name, len(raw),
+                   encode / NUMBER * 1000000,
+                   decode / NUMBER * 1000000))
+
+
+if __name__ == '__main__':
+    main()
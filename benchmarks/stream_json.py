@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Streaming JSON response benchmark.
+
+Sends ROWS generated rows as a JSON array through Response, buffered with
+json.dumps and Response.write, and streamed with Response.stream_json,
+each in a fresh process. Reports the peak resident memory, the time to
+the first chunk and the total time.
+
+    python benchmarks/stream_json.py [rows]
+"""
+from __future__ import print_function
+
+import sys
+import json
+import time
+import resource
+import subprocess
+
+from tachyonic.neutrino.response import Response
+
+
+def rows(count):
+    for i in range(count):
+        yield {'id': i,
+               'name': 'user %d' % i,
+               'email': 'user%d@example.com' % i,
+               'score': i * 0.5}
+
+
+def peak():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+    return peak / 1024.0
+
+
+def run(mode, count):
+    start = time.time()
+    resp = Response()
+    if mode == 'buffered':
+        resp.write(json.dumps(list(rows(count))))
+        body = resp
+    else:
+        resp.stream_json(rows(count), size=1000)
+        body = resp.stream_body()
+    first = None
+    size = 0
+    for chunk in body:
+        if first is None:
+            first = time.time() - start
+        size += len(chunk)
+    print("%-10s %10d %12d %12.1f %10.3f %10.2f" % (mode, count, size, peak(),
+                                                   first,
+                                                   time.time() - start))
+
+
+def main(count=1000000):
+    print("%-10s %10s %12s %12s %10s %10s" % ('mode', 'rows', 'bytes',
+                                              'peak MB', 'first s',
+                                              'seconds'))
+    for mode in ('buffered', 'streamed'):
+        subprocess.check_call([sys.executable, __file__, '--run', mode,
+                               str(count)])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3 and sys.argv[1] == '--run':
+        run(sys.argv[2], int(sys.argv[3]))
+    elif len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Request pipeline benchmark.
+
+Creates a throw away application root with a single view and pushes
+requests through Wsgi._interface with a stub start_response, reporting
+requests per second. No database or Redis is configured, so the numbers
+show the cost of the framework itself.
+
+    python benchmarks/wsgi.py [requests]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import logging
+import timeit
+from io import BytesIO
+
+SETTINGS = """[application]
+name = benchmark
+modules = benchapp
+middleware = benchapp.Middleware
+static = /static/
+
+[logging]
+"""
+
+VIEWS = """import tachyonic as root
+from tachyonic.neutrino import constants as const
+
+
+class Middleware(object):
+    def pre(self, req, resp):
+        pass
+
+
+@root.app.resource(const.HTTP_GET, '/hello/{name}')
+def hello(req, resp, name):
+    resp.headers['Content-Type'] = const.TEXT_PLAIN
+    return 'Hello %s' % (name,)
+"""
+
+
+def create(path):
+    os.makedirs(os.path.join(path, 'tmp'))
+    os.makedirs(os.path.join(path, 'templates'))
+    os.makedirs(os.path.join(path, 'benchapp'))
+    with open(os.path.join(path, 'settings.cfg'), 'w') as handle:
+        handle.write(SETTINGS)
+    with open(os.path.join(path, 'benchapp', '__init__.py'), 'w') as handle:
+        handle.write(VIEWS)
+
+
+def environ():
+    return {'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'PATH_INFO': '/hello/world',
+            'QUERY_STRING': '',
+            'REMOTE_ADDR': '127.0.0.1',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_COOKIE': 'tachyonic=benchmarksession0',
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO()}
+
+
+def start_response(status, headers):
+    pass
+
+
+def main(requests=5000):
+    from tachyonic.neutrino import app
+
+    path = tempfile.mkdtemp()
+    try:
+        create(path)
+        interface = app(path)
+        logging.getLogger().setLevel(logging.WARNING)
+
+        def request():
+            for chunk in interface(environ(), start_response):
+                pass
+
+        seconds = min(timeit.repeat(request, number=requests, repeat=3))
+        print("%d requests in %.3fs (%.0f requests/second)" %
+              (requests, seconds, requests / seconds))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
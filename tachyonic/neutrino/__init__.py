@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 
 from .wsgi import app
+from .redissy import redis
 from . import metadata
 """
 from . import config
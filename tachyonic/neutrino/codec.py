@@ -0,0 +1,183 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import logging
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import json
+import base64
+from datetime import datetime
+from datetime import date
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from tachyonic.neutrino import exceptions
+
+log = logging.getLogger(__name__)
+
+# Encoded values start with a NUL byte followed by the codec tag. Neither
+# pickles nor the plain strings stored by earlier releases start with NUL,
+# so untagged data is handed to the legacy decoder given to decode().
+_MARKER = b'\x00'
+
+_DATETIME = '%Y-%m-%dT%H:%M:%S.%f'
+_DATE = '%Y-%m-%d'
+
+if sys.version_info[0] == 2:
+    _text = unicode
+    _bytes = None
+else:
+    _text = str
+    _bytes = bytes
+
+
+class Pickle(object):
+    tag = b'P'
+
+    def dumps(self, value):
+        return pickle.dumps(value, 2)
+
+    def loads(self, raw):
+        return pickle.loads(raw)
+
+
+class Json(object):
+    """JSON with type tags.
+
+    Values JSON can't represent are wrapped in {"__t__": type, "v": value}
+    objects, so tuples, sets, dates, bytes and dictionaries with non string
+    keys round trip with their types.
+    """
+    tag = b'J'
+
+    def _encode(self, value):
+        if value is None or isinstance(value, (bool, int, float, _text)):
+            return value
+        elif isinstance(value, list):
+            return [self._encode(v) for v in value]
+        elif isinstance(value, dict):
+            for k in value:
+                if not isinstance(k, _text) or k == '__t__':
+                    return {'__t__': 'dict',
+                            'v': [[self._encode(k), self._encode(v)]
+                                  for k, v in value.items()]}
+            return dict((k, self._encode(v)) for k, v in value.items())
+        elif isinstance(value, tuple):
+            return {'__t__': 'tuple', 'v': [self._encode(v) for v in value]}
+        elif isinstance(value, (set, frozenset)):
+            return {'__t__': 'set', 'v': [self._encode(v) for v in value]}
+        elif isinstance(value, datetime):
+            return {'__t__': 'datetime', 'v': value.strftime(_DATETIME)}
+        elif isinstance(value, date):
+            return {'__t__': 'date', 'v': value.strftime(_DATE)}
+        elif _bytes is not None and isinstance(value, _bytes):
+            return {'__t__': 'bytes',
+                    'v': base64.b64encode(value).decode('ascii')}
+        elif isinstance(value, str):
+            # Python 2 byte strings.
+            return value.decode('utf-8')
+        elif sys.version_info[0] == 2 and isinstance(value, long):
+            return value
+        else:
+            raise TypeError("Can't encode %r as JSON" % (value,))
+
+    def _hook(self, obj):
+        t = obj.get('__t__')
+        if t is None:
+            return obj
+        v = obj['v']
+        if t == 'dict':
+            return dict((k, val) for k, val in v)
+        elif t == 'tuple':
+            return tuple(v)
+        elif t == 'set':
+            return set(v)
+        elif t == 'datetime':
+            return datetime.strptime(v, _DATETIME)
+        elif t == 'date':
+            return datetime.strptime(v, _DATE).date()
+        elif t == 'bytes':
+            return base64.b64decode(v)
+        return obj
+
+    def dumps(self, value):
+        return json.dumps(self._encode(value),
+                          separators=(',', ':')).encode('utf-8')
+
+    def loads(self, raw):
+        return json.loads(raw.decode('utf-8'), object_hook=self._hook)
+
+
+class Msgpack(object):
+    """msgpack binary encoding.
+
+    Requires the optional msgpack package. Tuples decode as lists and
+    datetimes round trip through an extension type.
+    """
+    tag = b'M'
+
+    def _default(self, value):
+        if isinstance(value, datetime):
+            return msgpack.ExtType(1, value.strftime(_DATETIME).encode('ascii'))
+        elif isinstance(value, date):
+            return msgpack.ExtType(2, value.strftime(_DATE).encode('ascii'))
+        elif isinstance(value, (set, frozenset)):
+            return list(value)
+        raise TypeError("Can't encode %r with msgpack" % (value,))
+
+    def _ext(self, code, data):
+        if code == 1:
+            return datetime.strptime(data.decode('ascii'), _DATETIME)
+        elif code == 2:
+            return datetime.strptime(data.decode('ascii'), _DATE).date()
+        return msgpack.ExtType(code, data)
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True, default=self._default)
+
+    def loads(self, raw):
+        return msgpack.unpackb(raw, raw=False, ext_hook=self._ext)
+
+
+codecs = {'pickle': Pickle,
+          'json': Json,
+          'msgpack': Msgpack}
+
+_tags = {}
+for _codec in codecs.values():
+    _tags[_codec.tag] = _codec()
+
+
+def get(name):
+    """Return the codec registered as name."""
+    if name not in codecs:
+        raise exceptions.Error("Unknown codec '%s'" % (name,))
+    if name == 'msgpack' and msgpack is None:
+        raise exceptions.Error("Codec 'msgpack' requires msgpack" +
+                               " - pip install msgpack")
+    return _tags[codecs[name].tag]
+
+
+def encode(codec, value):
+    return _MARKER + codec.tag + codec.dumps(value)
+
+
+def decode(raw, legacy=None):
+    """Decode raw with the codec it was encoded with.
+
+    Untagged data is returned as is or passed to legacy if given.
+    """
+    if raw[:1] == _MARKER:
+        codec = _tags.get(raw[1:2])
+        if codec is not None:
+            return codec.loads(raw[2:])
+    if legacy is not None:
+        return legacy(raw)
+    return raw
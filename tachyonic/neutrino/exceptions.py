@@ -56,7 +56,7 @@ class FieldDoesNotExist(DoesNotExist):
         return str(self.field)
 
 
-class MultipleOblectsReturned(ValidationError):
+class MultipleObjectsReturned(ValidationError):
     def __init__(self, description):
         Exception.__init__(self, description)
         self.description = description
@@ -65,6 +65,10 @@ class MultipleOblectsReturned(ValidationError):
         return str(self.description)
 
 
+# Misspelled name of earlier releases.
+MultipleOblectsReturned = MultipleObjectsReturned
+
+
 class HTTPError(Error):
     def __init__(self, status, title, description):
         Exception.__init__(self, description)
@@ -226,6 +230,15 @@ class HTTPServiceUnavailable(HTTPError):
         super(HTTPServiceUnavailable, self).__init__(const.HTTP_503, title, description)
 
 
+class PoolTimeout(HTTPServiceUnavailable):
+    """
+    No pooled connection became available in time.
+    """
+
+    def __init__(self, description):
+        super(PoolTimeout, self).__init__('Service Unavailable', description)
+
+
 class HTTPInvalidHeader(HTTPBadRequest):
     """
     A header in the request is invalid.
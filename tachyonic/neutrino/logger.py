@@ -58,7 +58,12 @@ class Logger(object):
 
         logger = logging.getLogger()
 
-        logger.setLevel(logging.DEBUG)
+        # The level lets isEnabledFor() skip debug records before they are
+        # built, the filter below still drops them for other handlers.
+        if debug is True:
+            logger.setLevel(logging.DEBUG)
+        else:
+            logger.setLevel(logging.INFO)
 
         if host is not None and (host == '127.0.0.1' or host == 'localhost'):
             if self._is_socket('/dev/log'):
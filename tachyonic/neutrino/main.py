@@ -7,11 +7,8 @@ from __future__ import print_function
 import os
 import sys
 import site
-import re
 import argparse
 import logging
-import time
-import datetime
 import hashlib
 from wsgiref import simple_server
 
@@ -21,6 +18,7 @@ from tachyonic.neutrino import app
 from tachyonic.neutrino import constants as const
 from tachyonic.neutrino.utils.general import import_module
 from tachyonic.neutrino.config import Config
+from tachyonic.neutrino.session import sweep
 from tachyonic.neutrino import metadata
 
 log = logging.getLogger(__name__)
@@ -249,25 +247,12 @@ def create(args):
 
 def session(args):
     path = args.path
-    c = 0
     if os.path.exists("%s/settings.cfg" % (path,)):
         config = Config("%s/settings.cfg" % (path,))
         app_config = config.get('application')
-        session_expire = app_config.get('session_expire', 3600)
-        r = re.compile('^.*session$')
+        session_expire = int(app_config.get('session_expire', 3600))
         if os.path.exists("%s/tmp" % (path,)):
-            files = os.listdir("%s/tmp" % (path,))
-            for f in files:
-                fpath = "%s/tmp/%s" % (path, f)
-                if os.path.isfile(fpath):
-                    if r.match(fpath):
-                        now = datetime.datetime.now()
-                        ts = int(time.mktime(now.timetuple()))
-                        stat = os.stat(fpath)
-                        lm = int(stat.st_mtime)
-                        if ts - lm > session_expire:
-                            os.remove(fpath)
-                            c += 1
+            c = sweep("%s/tmp" % (path,), session_expire)
             print("Removed expired sessions: %s\n" % c)
         else:
             print("Missing tmp folder")
@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import sys
 import logging
 from collections import OrderedDict
 from collections import Iterator
@@ -11,12 +12,18 @@ from datetime import datetime
 import json
 import uuid
 import re
+if sys.version[0] == '2':
+    import thread
+else:
+    import _thread as thread
 
 import phonenumbers
 
 from tachyonic.neutrino.utils.general import ObjectName
+from tachyonic.neutrino.utils.general import json_array
 from tachyonic.neutrino import creation_counter
 from tachyonic.neutrino import exceptions
+from tachyonic.neutrino import querycache
 from tachyonic.neutrino import constants as const
 from tachyonic.neutrino.password import hash as hash_password
 from tachyonic.neutrino.password import valid as is_password
@@ -24,18 +31,88 @@ from tachyonic.neutrino.password import valid as is_password
 
 log = logging.getLogger(__name__)
 
+# SQL generated for models, built once per process and keyed on table,
+# operation and the fields involved.
+_statements = {}
 
-def _declared_fields(cls):
-    current_fields = []
-    for name in dir(cls):
-        prop = getattr(cls, name)
-        if isinstance(prop, Field):
-            prop = copy(prop)
-            current_fields.append((name, prop))
-            prop._name = name
+# Unit of work per thread for models declaring Meta.unit_of_work.
+_units = {}
 
-    current_fields.sort(key=lambda x: x[1].creation_counter)
-    return OrderedDict(current_fields)
+
+class UnitOfWork(object):
+    """Pending writes and loaded rows of models using Meta.unit_of_work.
+
+    Assigning to such a model only marks the fields dirty. flush() then
+    writes one UPDATE or INSERT per object with all its dirty fields.
+    Rows loaded by primary key are kept in an identity map, so each row
+    is read at most once until clear().
+    """
+    def __init__(self):
+        self.identity = {}
+        self.pending = OrderedDict()
+
+    def add(self, obj, updates):
+        key = id(obj)
+        if key in self.pending:
+            self.pending[key][1].update(updates)
+        else:
+            self.pending[key] = (obj, dict(updates))
+
+    def evict(self, table):
+        """Forget the loaded rows of table."""
+        for key in [key for key in self.identity if key[0] == table]:
+            del self.identity[key]
+
+    def flush(self):
+        while len(self.pending) > 0:
+            key, (obj, updates) = self.pending.popitem(last=False)
+            obj._flush(updates)
+
+
+def unit_of_work():
+    """Unit of work of the current thread."""
+    thread_id = thread.get_ident()
+    try:
+        return _units[thread_id]
+    except KeyError:
+        unit = _units[thread_id] = UnitOfWork()
+        return unit
+
+
+def flush():
+    """Write the pending changes of the current thread."""
+    unit = _units.get(thread.get_ident())
+    if unit is not None:
+        unit.flush()
+
+
+def clear():
+    """Discard the identity map and pending changes of the current thread."""
+    _units.pop(thread.get_ident(), None)
+
+
+def _declared_fields(obj):
+    """Fields declared on the class of obj in declaration order.
+
+    The class is introspected once and the field specs are kept on it,
+    shared by all instances. Each instance gets its own mapping since
+    _init_db() may add the primary key.
+    """
+    cls = obj.__class__
+    specs = cls.__dict__.get('_field_specs')
+    if specs is None:
+        current_fields = []
+        for name in dir(cls):
+            prop = getattr(cls, name)
+            if isinstance(prop, Field):
+                prop = copy(prop)
+                current_fields.append((name, prop))
+                prop._name = name
+
+        current_fields.sort(key=lambda x: x[1].creation_counter)
+        specs = tuple(current_fields)
+        cls._field_specs = specs
+    return OrderedDict(specs)
 
 
 class FieldChecks(object):
@@ -187,16 +264,35 @@ class Mysql(object):
         else:
             self.db_primary_key = 'id'
 
+        if hasattr(meta, 'cache_ttl'):
+            self.cache_ttl = float(meta.cache_ttl)
+        else:
+            self.cache_ttl = None
+
+        if hasattr(meta, 'unit_of_work'):
+            self.unit_of_work = meta.unit_of_work
+        else:
+            self.unit_of_work = False
+
         if hasattr(meta, 'db_query'):
             self.db_query = meta.db_query
         else:
-            fields = ", ".join(self.declared_fields)
-            self.db_query = "SELECT %s FROM %s" % (fields, self.db_table,)
+            cache = (self.db_table, 'query', tuple(self.declared_fields))
+            self.db_query = _statements.get(cache)
+            if self.db_query is None:
+                fields = ", ".join(self.declared_fields)
+                self.db_query = "SELECT %s FROM %s" % (fields, self.db_table,)
+                _statements[cache] = self.db_query
 
     def foreign_key(self, id=None, key=None):
-        fields = ", ".join(self.declared_fields)
-        sql = "SELECT %s FROM %s" % (fields, self.db_table,)
-        sql += " WHERE %s = %s" % (key, '%s')
+        cache = (self.db_table, 'foreign_key', key,
+                 tuple(self.declared_fields))
+        sql = _statements.get(cache)
+        if sql is None:
+            fields = ", ".join(self.declared_fields)
+            sql = "SELECT %s FROM %s" % (fields, self.db_table,)
+            sql += " WHERE %s = %s" % (key, '%s')
+            _statements[cache] = sql
         result = self.db.execute(sql, (id,))
         if len(result) > 0:
             if len(result) == 1:
@@ -204,32 +300,89 @@ class Mysql(object):
             else:
                 raise exceptions.MultipleObjectsReturned("Multiple rows for foreign key")
 
+    def select_in(self, key, values, chunk_size=1000):
+        """Rows with key in values using one query per chunk_size values.
+
+        The key column is selected even if it is not declared, the rows
+        returned are not cleaned.
+        """
+        cache = (self.db_table, 'select_in', key,
+                 tuple(self.declared_fields))
+        sql = _statements.get(cache)
+        if sql is None:
+            fields = list(self.declared_fields)
+            if key not in fields:
+                fields.append(key)
+            sql = "SELECT %s FROM %s" % (", ".join(fields), self.db_table,)
+            sql += " WHERE %s IN " % (key,)
+            _statements[cache] = sql
+        result = []
+        for start in range(0, len(values), chunk_size):
+            chunk = tuple(values[start:start + chunk_size])
+            result.extend(self._execute(sql + "(%s)" %
+                                        (",".join(['%s'] * len(chunk)),),
+                                        chunk))
+        return result
+
     def select(self, id=None, values=None, sql=None):
         if sql is None:
             sql = self.db_query
 
         result = None
         if id is not None:
-            fields = ", ".join(self.declared_fields)
-            sql = "SELECT %s FROM %s" % (fields, self.db_table,)
-            sql += " WHERE %s = %s" % (self.db_primary_key, '%s')
-            result = self.db.execute(sql, (id,))
+            if self.unit_of_work is True:
+                row = unit_of_work().identity.get((self.db_table, id))
+                if row is not None:
+                    return self._clean([row])
+            cache = (self.db_table, 'select', self.db_primary_key,
+                     tuple(self.declared_fields))
+            sql = _statements.get(cache)
+            if sql is None:
+                fields = ", ".join(self.declared_fields)
+                sql = "SELECT %s FROM %s" % (fields, self.db_table,)
+                sql += " WHERE %s = %s" % (self.db_primary_key, '%s')
+                _statements[cache] = sql
+            result = self._execute(sql, (id,))
             if len(result) > 0:
                 if len(result) != 1:
                     raise exceptions.MultipleObjectsReturned("Multiple rows for id")
             else:
                 raise exceptions.DoesNotExist("No row matching id")
+            if self.unit_of_work is True:
+                unit_of_work().identity[(self.db_table, id)] = dict(result[0])
         else:
-            result = self.db.execute(sql, values)
+            result = self._execute(sql, values)
         return self._clean(result)
 
+    def exists(self, id):
+        try:
+            return len(self.select(id=id)) > 0
+        except exceptions.DoesNotExist:
+            return False
+
+    def defer(self, obj, updates):
+        unit_of_work().add(obj, updates)
+
+    def _execute(self, sql, values):
+        # Models declaring Meta.cache_ttl read through the query cache,
+        # except in a transaction that wrote since it may read its own
+        # uncommitted rows.
+        if self.cache_ttl is None or self.db.writing():
+            return self.db.execute(sql, values)
+        key = querycache.key(self.db_table, sql, values)
+        result = querycache.get(key)
+        if result is None:
+            result = self.db.execute(sql, values)
+            querycache.put(key, result, self.cache_ttl)
+        return result
+
     def _clean(self, result):
         clean = []
         for r in result:
             t = {}
             for f in r:
                 if f in self.declared_fields:
-                    orm_field = getattr(self._model, f)
+                    orm_field = self.declared_fields[f]
                     if orm_field.nodb is False:
                         t[f] = r[f]
             clean.append(t)
@@ -239,58 +392,132 @@ class Mysql(object):
         fields = []
         values = []
 
-        insert = []
-        sql_str_values = []
         for declared_field in self.declared_fields:
             if declared_field in data:
                 field = declared_field
-                orm_field = getattr(self._model, field)
+                orm_field = self.declared_fields[field]
                 if orm_field.nodb is False:
                     fields.append(field)
                     values.append(data[field])
-                    insert.append("%s" % (field))
-                    sql_str_values.append("%s" % ('%s'))
-
-        insert = ",".join(insert)
-        sql_str_values = ",".join(sql_str_values)
 
-        sql = "INSERT INTO %s (%s)" % (self.db_table, insert) +\
-              " VALUES (%s)" % (sql_str_values,)
+        cache = (self.db_table, 'insert', tuple(fields))
+        sql = _statements.get(cache)
+        if sql is None:
+            insert = ",".join(fields)
+            sql_str_values = ",".join(['%s'] * len(fields))
+            sql = "INSERT INTO %s (%s)" % (self.db_table, insert) +\
+                  " VALUES (%s)" % (sql_str_values,)
+            _statements[cache] = sql
         self.db.execute(sql, tuple(values))
+        self.db.written(self.db_table)
 
         return self.db.last_row_id()
 
+    def bulk_insert(self, rows, chunk_size=1000, update=False):
+        """Insert rows using one multi row INSERT per chunk_size rows.
+
+        Columns missing from a row are inserted as DEFAULT. With update
+        set existing rows are updated via ON DUPLICATE KEY UPDATE.
+        Returns the number of affected rows.
+        """
+        fields = []
+        for declared_field in self.declared_fields:
+            orm_field = self.declared_fields[declared_field]
+            if orm_field.nodb is False:
+                for row in rows:
+                    if declared_field in row:
+                        fields.append(declared_field)
+                        break
+
+        cache = (self.db_table, 'bulk_insert', self.db_primary_key,
+                 tuple(fields), update)
+        try:
+            sql, duplicate = _statements[cache]
+        except KeyError:
+            sql = "INSERT INTO %s (%s) VALUES " % (self.db_table,
+                                                   ",".join(fields))
+            if update is True:
+                duplicate = ["%s=VALUES(%s)" % (field, field)
+                             for field in fields
+                             if field != self.db_primary_key]
+                if len(duplicate) == 0:
+                    duplicate = ["%s=%s" % (self.db_primary_key,
+                                            self.db_primary_key)]
+                duplicate = " ON DUPLICATE KEY UPDATE %s" % (",".join(duplicate),)
+            else:
+                duplicate = ""
+            _statements[cache] = (sql, duplicate)
+
+        count = 0
+        for start in range(0, len(rows), chunk_size):
+            values = []
+            sql_str_values = []
+            for row in rows[start:start + chunk_size]:
+                sql_str_value = []
+                for field in fields:
+                    if field in row:
+                        values.append(row[field])
+                        sql_str_value.append('%s')
+                    else:
+                        sql_str_value.append('DEFAULT')
+                sql_str_values.append("(%s)" % (",".join(sql_str_value),))
+            self.db.execute(sql + ",".join(sql_str_values) + duplicate,
+                            tuple(values))
+            count += self.db.last_row_count() or 0
+        self.db.written(self.db_table)
+        if update is True and self.unit_of_work is True:
+            # Rows may be matched on any unique key, so the updated ids
+            # are not known.
+            unit_of_work().evict(self.db_table)
+
+        return count
+
     def update(self, data, id):
         fields = []
         values = []
-        update = []
         for declared_field in self.declared_fields:
             if declared_field in data:
                 field = declared_field
-                orm_field = getattr(self._model, field)
+                orm_field = self.declared_fields[field]
                 if orm_field.nodb is False:
                     fields.append(field)
                     values.append(data[field])
-                    update.append("%s=%s" % (field, "%s"))
         values.append(id)
 
-        update = ",".join(update)
-
-        sql = "UPDATE %s SET %s" % (self.db_table, update) +\
-              " WHERE %s = %s" % (self.db_primary_key, '%s')
+        cache = (self.db_table, 'update', self.db_primary_key, tuple(fields))
+        sql = _statements.get(cache)
+        if sql is None:
+            update = ",".join(["%s=%s" % (field, "%s") for field in fields])
+            sql = "UPDATE %s SET %s" % (self.db_table, update) +\
+                  " WHERE %s = %s" % (self.db_primary_key, '%s')
+            _statements[cache] = sql
         self.db.execute(sql, tuple(values))
+        self.db.written(self.db_table)
+        if self.unit_of_work is True:
+            row = unit_of_work().identity.get((self.db_table, id))
+            if row is not None:
+                row.update(data)
 
     def commit(self):
+        flush()
         self.db.commit()
 
     def rollback(self):
+        clear()
         self.db.rollback()
 
     def delete(self, id):
-        sql = "DELETE FROM %s WHERE %s = %s" % (self.db_table,
-                                                self.db_primary_key,
-                                                '%s')
+        cache = (self.db_table, 'delete', self.db_primary_key)
+        sql = _statements.get(cache)
+        if sql is None:
+            sql = "DELETE FROM %s WHERE %s = %s" % (self.db_table,
+                                                    self.db_primary_key,
+                                                    '%s')
+            _statements[cache] = sql
         self.db.execute(sql, (id,))
+        self.db.written(self.db_table)
+        if self.unit_of_work is True:
+            unit_of_work().identity.pop((self.db_table, id), None)
 
 
 class Field(ObjectName):
@@ -308,6 +535,7 @@ class Field(ObjectName):
         self._parent = None
         self._parent_key = None
         self._parent_key_value = None
+        self._prefetched = None
 
         attributes = {
             'label': self._name,
@@ -369,6 +597,13 @@ class Field(ObjectName):
                 if self._db_primary_key not in self._declared_fields:
                     self._declared_fields[self._db_primary_key] = Model.Integer(hidden=True)
 
+    def __copy__(self):
+        # Fields are copied from their specs for every value set, the
+        # generic copy protocol is several times slower.
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        return new
+
     def _val(self, value, validate=True):
         if hasattr(self, '_validate') and validate is True:
             value = self._validate(value)
@@ -396,41 +631,45 @@ class Field(ObjectName):
         else:
             return self._data
 
-    class _JsonEncoder(json.JSONEncoder):
-        def default(self, o):
-            if isinstance(o.value(), datetime):
-                return str(o.value().strftime("%Y/%m/%d %H:%M:%S"))
-            elif isinstance(o, Fields.JsonObject):
-                if o.value() is not None and o.value().strip() != '':
-                    return json.loads(o.value())
-            else:
-                return o.value()
-
-    class _JsonDecoder(json.JSONDecoder):
-        def __init__(self, list_type=list,  **kwargs):
-            json.JSONDecoder.__init__(self, **kwargs)
-            # Use the custom JSONArray
-            self.parse_array = self.JSONArray
-            # Use the python implemenation of the scanner
-            self.scan_once = json.scanner.py_make_scanner(self)
-            self.list_type = list_type
-
-        def JSONArray(self, s_and_end, scan_once, **kwargs):
-            values, end = json.decoder.JSONArray(s_and_end,
-                                                 scan_once,
-                                                 **kwargs)
-            return self.list_type(values), end
+    def dump(self):
+        """Plain Python value of the field for serializing.
+
+        Walks the declared fields once, datetimes become strings, JSON
+        objects are decoded and passwords left out.
+        """
+        return _encoder(self)(self)
 
     def dump_json(self, **kwargs):
-        return json.dumps(self,
-                          cls=self._JsonEncoder,
-                          **kwargs)
+        if isinstance(self._data, list) and _JsonWriter.fast(kwargs):
+            return ''.join(self.iter_json(len(self._data) + 1, **kwargs))
+        return json.dumps(self.dump(), **kwargs)
+
+    def iter_json(self, rows=100, **kwargs):
+        """dump_json() of a list in chunks of rows rows."""
+        if not isinstance(self._data, list):
+            yield self.dump_json(**kwargs)
+            return
+        if _JsonWriter.fast(kwargs):
+            writer = _JsonWriter(self._declared_fields, **kwargs)
+            write = writer.write
+            separator = writer.item_separator
+        else:
+            encoder = json.JSONEncoder(**kwargs)
+            encode = _row_encoder(self)
+            write = lambda row: encoder.encode(encode(row))
+            separator = encoder.item_separator
+        for chunk in json_array(self._data, write, separator, rows):
+            yield chunk
 
     def load_json(self, fp, **kwargs):
         if isinstance(self._data, list):
-            json.loads(fp, cls=self._JsonDecoder, list_type=self)
+            obj = json.loads(fp, **kwargs)
+            if not isinstance(obj, list):
+                raise exceptions.ValidationError("'load_json() expecting" +
+                                                 " list")
+            self(obj)
         elif isinstance(self._data, dict):
-            self._set(json.loads(fp, cls=self._JsonDecoder, list_type=self))
+            self._set(json.loads(fp, **kwargs))
         else:
             raise exceptions.ValidationError("'load_json() only works with dictionary/list")
 
@@ -444,6 +683,9 @@ class Field(ObjectName):
         else:
             raise exceptions.ValidationError("'load() only works with dictionary/list")
 
+    def flush(self):
+        flush()
+
     def commit(self):
         if hasattr(self, '_db'):
             self._db.commit()
@@ -475,7 +717,7 @@ class Fields(object):
         def __len__(self):
             return len(self._data)
 
-        def append(self, v, validate=True):
+        def _row(self, v, validate=True):
             new = Fields.Dict()
             setattr(new, '_declared_fields', self._declared_fields)
             if hasattr(self, 'Meta'):
@@ -484,15 +726,110 @@ class Fields(object):
             if self._dbo is not None:
                 new._dbo = self._dbo
                 new._init_db()
+            new._prefetched = self._prefetched
             new._set(v, validate)
-            self._data.append(new)
+            new._prefetched = None
+            return new
 
-        def query(self, sql=None, values=None):
+        def append(self, v, validate=True):
+            self._data.append(self._row(v, validate))
+
+        def bulk_insert(self, rows, chunk_size=1000, update=False,
+                        validate=True, append=False):
+            """Validate and insert rows with multi row INSERT statements.
+
+            Unlike append() rows are not checked for existence one at a
+            time; use update to overwrite rows with existing keys. Auto
+            increment primary keys are not read back into the rows. The
+            rows are only added to the list with append, which costs the
+            same as append() without the INSERTs, including the queries
+            for foreign key sub models. Returns the number of affected rows.
+            """
+            clean = []
+            for row in rows:
+                values = {}
+                for key in row:
+                    if key not in self._declared_fields:
+                        raise exceptions.FieldDoesNotExist(key)
+                    field = self._declared_fields[key]
+                    if isinstance(field, Fields.List):
+                        raise exceptions.ValidationError("Property is a" +
+                                                         " List Model")
+                    values[key] = field._val(row[key], validate)
+                if hasattr(self, '_db'):
+                    pri_field = self._declared_fields.get(self._db_primary_key)
+                    if (isinstance(pri_field, Fields.Uuid) and
+                            self._db_primary_key not in values):
+                        values[self._db_primary_key] = str(uuid.uuid4())
+                clean.append(values)
+
+            count = 0
+            if hasattr(self, '_db') and len(clean) > 0:
+                count = self._db.bulk_insert(clean, chunk_size, update)
+
+            if append is True:
+                for values in clean:
+                    self.append(values, False)
+
+            return count
+
+        def query(self, sql=None, values=None, prefetch=None,
+                  compact=False):
+            """Load rows, optionally with their foreign key sub models.
+
+            prefetch lists Dict fields declared with a foreign_key. These
+            are loaded for all rows with one query per field instead of
+            one per row.
+
+            With compact the rows are loaded as read only Row objects
+            holding plain values, see Row.
+            """
             if hasattr(self, '_db'):
                 self._data = []
                 result = self._db.select(sql=sql,values=values)
+                prefetched = None
+                if prefetch is not None:
+                    prefetched = self._prefetch(result, prefetch)
+                if compact is True:
+                    self._data = _rows(self, result, prefetched)
+                    return
+                self._prefetched = prefetched
+                try:
+                    for row in result:
+                        self.append(row, False)
+                finally:
+                    self._prefetched = None
+
+        def _prefetch(self, result, prefetch):
+            prefetched = {}
+            for name in prefetch:
+                if name not in self._declared_fields:
+                    raise exceptions.FieldDoesNotExist(name)
+                field = self._declared_fields[name]
+                if (not isinstance(field, Fields.Dict) or
+                        field.foreign_key is None or
+                        not hasattr(field, '_db')):
+                    raise exceptions.ValidationError("Property '%s' is not" %
+                                                     (name,) +
+                                                     " a foreign key Model")
+                keys = []
+                seen = set()
                 for row in result:
-                    self.append(row, False)
+                    key = row.get(name)
+                    if key is not None and key not in seen:
+                        seen.add(key)
+                        keys.append(key)
+                rows = {}
+                result = field._db.select_in(field.foreign_key, keys)
+                for raw, row in zip(result, field._db._clean(result)):
+                    key = raw[field.foreign_key]
+                    if key in rows:
+                        raise exceptions.MultipleObjectsReturned("Multiple" +
+                                                                 " rows for" +
+                                                                 " foreign key")
+                    rows[key] = row
+                prefetched[name] = rows
+            return prefetched
 
         def __call__(self, v):
             for i in v:
@@ -530,7 +867,11 @@ class Fields(object):
                                     updates[i] = val[fk]
                             else:
                                 self._data[i]._parent_key_value = val
-                                self._data[i].query()
+                                if (self._prefetched is not None and
+                                        i in self._prefetched):
+                                    self._data[i]._load(self._prefetched[i].get(val))
+                                else:
+                                    self._data[i].query()
                                 updates[i] = val
                         else:
                             if (hasattr(self._data[i], '_validate') and
@@ -540,7 +881,11 @@ class Fields(object):
                             if self._data[i].store is True:
                                 updates[i] = val
 
-                    if hasattr(self, '_db') and validate is True:
+                    if (hasattr(self, '_db') and validate is True and
+                            self._db.unit_of_work is True):
+                        if len(updates) > 0:
+                            self._db.defer(self, updates)
+                    elif hasattr(self, '_db') and validate is True:
                         if len(updates) > 0:
                             if self._db_primary_key in self._data:
                                 id = self._data[self._db_primary_key].value()
@@ -589,6 +934,32 @@ class Fields(object):
                 else:
                     raise exceptions.ValidationError("'%s' Expecting dictionary" % (str(self._objectname()),))
 
+        def _flush(self, updates):
+            id = None
+            if self._db_primary_key in self._data:
+                id = self._data[self._db_primary_key].value()
+            if id is not None and self._db.exists(id):
+                self._db.update(updates, id)
+                return
+
+            pri_field = self._declared_fields.get(self._db_primary_key)
+            if id is None and isinstance(pri_field, Fields.Uuid):
+                id = str(uuid.uuid4())
+                updates[self._db_primary_key] = id
+                self._db.insert(updates)
+            elif id is not None:
+                updates[self._db_primary_key] = id
+                self._db.insert(updates)
+            else:
+                id = self._db.insert(updates)
+            if self._db_primary_key not in self._data:
+                self._data[self._db_primary_key] = self._get_field(self._db_primary_key)
+            self._data[self._db_primary_key]._set(id)
+            self._id = id
+            if self.foreign_key in updates:
+                self._parent_key_value = updates[self.foreign_key]
+                self._parent._set({self._parent_key: self._parent_key_value})
+
         def __setitem__(self, key, value):
             self._set({key: value})
 
@@ -659,6 +1030,14 @@ class Fields(object):
                     if len(result) == 1:
                         self._set(result[0], False)
 
+        def _load(self, row):
+            # Sub model row fetched by List.query(prefetch=...).
+            self._data = {}
+            self._id = None
+            if row is not None:
+                self._id = row.get(self._db_primary_key)
+                self._set(row, False)
+
         def get(self, key, default=None):
             try:
                 return self._data[key]
@@ -847,6 +1226,282 @@ class Fields(object):
             return value
 
 
+_DATETIME = "%Y/%m/%d %H:%M:%S"
+
+
+def _dump_value(field):
+    value = field._data
+    if isinstance(value, datetime):
+        return value.strftime(_DATETIME)
+    return value
+
+
+def _dump_json_object(field):
+    value = field._data
+    if value is not None and value.strip() != '':
+        return json.loads(value)
+    return None
+
+
+def _dump_password(field):
+    return None
+
+
+def _dump_dict(field):
+    result = OrderedDict()
+    data = field._data
+    for name, encode in _schema(field._declared_fields):
+        if name in data:
+            result[name] = encode(data[name])
+    return result
+
+
+def _dump_list(field):
+    encode = _row_encoder(field)
+    return [encode(row) for row in field._data]
+
+
+def _encoder(field):
+    if isinstance(field, Fields.Dict):
+        return _dump_dict
+    elif isinstance(field, Fields.List):
+        return _dump_list
+    elif isinstance(field, Fields.JsonObject):
+        return _dump_json_object
+    elif isinstance(field, Fields.Password):
+        return _dump_password
+    return _dump_value
+
+
+def _schema(declared_fields):
+    return [(name, _encoder(declared_fields[name]))
+            for name in declared_fields]
+
+
+def _row_encoder(field):
+    # Rows of a list share its declared fields, so the schema is built
+    # once per list instead of once per row.
+    schema = _schema(field._declared_fields)
+
+    def encode(row):
+        if isinstance(row, Row):
+            return row.dump()
+        result = OrderedDict()
+        data = row._data
+        for name, dump in schema:
+            if name in data:
+                result[name] = dump(data[name])
+        return result
+    return encode
+
+
+class _JsonWriter(object):
+    """Writes the rows of a list as JSON text.
+
+    The keys and a writer per declared field are prepared once, so each
+    value is written by a function for its field type instead of going
+    through the generic encoder. Only the separators and ensure_ascii
+    options are supported, see fast().
+    """
+    def __init__(self, declared_fields, separators=None, ensure_ascii=True):
+        if separators is None:
+            separators = (', ', ': ')
+        self.item_separator, key_separator = separators
+        if ensure_ascii is True:
+            self.quote = json.encoder.encode_basestring_ascii
+        else:
+            self.quote = json.encoder.encode_basestring
+        self.encoder = json.JSONEncoder(separators=separators,
+                                        ensure_ascii=ensure_ascii)
+        self.fields = []
+        for name in declared_fields:
+            self.fields.append((name,
+                                self.quote(name) + key_separator,
+                                self._writer(declared_fields[name])))
+
+    @staticmethod
+    def fast(kwargs):
+        for arg in kwargs:
+            if arg not in ('separators', 'ensure_ascii'):
+                return False
+        return True
+
+    def _writer(self, field):
+        if isinstance(field, (Fields.Dict, Fields.List, Fields.JsonObject)):
+            return lambda field: self.encoder.encode(field.dump())
+        elif isinstance(field, Fields.Password):
+            return lambda field: 'null'
+        return self.value
+
+    def value(self, field):
+        value = field._data
+        if value is None:
+            return 'null'
+        elif isinstance(value, basestring):
+            return self.quote(value)
+        elif value is True:
+            return 'true'
+        elif value is False:
+            return 'false'
+        elif isinstance(value, (int, long)):
+            return str(value)
+        elif isinstance(value, datetime):
+            return self.quote(value.strftime(_DATETIME))
+        return self.encoder.encode(value)
+
+    def write(self, row):
+        if isinstance(row, Row):
+            return self.encoder.encode(row.dump())
+        data = row._data
+        return '{' + self.item_separator.join(
+            [key + write(data[name])
+             for name, key, write in self.fields
+             if name in data]) + '}'
+
+
+class _Columns(object):
+    # Column names and model shared by the rows of a compact query.
+    def __init__(self, model, names):
+        self.model = model
+        self.names = tuple(names)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.hidden = set(name for name in self.names
+                          if isinstance(model._declared_fields[name],
+                                        Fields.Password))
+        self.json = set(name for name in self.names
+                        if isinstance(model._declared_fields[name],
+                                      Fields.JsonObject))
+        # Prefetched sub model rows by column and foreign key value.
+        self.related = {}
+        # Same conversions as Bool._set and Phone._set on the Dict path.
+        self.convert = []
+        for i, name in enumerate(self.names):
+            field = model._declared_fields[name]
+            if isinstance(field, Fields.Bool):
+                self.convert.append((i, _bool))
+            elif isinstance(field, Fields.Phone):
+                self.convert.append((i, _phone))
+
+
+def _bool(value):
+    if isinstance(value, int):
+        return value == 1
+    return value
+
+
+def _phone(value):
+    if value is not None:
+        return value.replace(' ', '')
+    return value
+
+
+class Row(object):
+    """Read only row loaded by List.query(compact=True).
+
+    Holds the plain column values in a tuple and shares the column names
+    with the other rows of the result, instead of a Field object per
+    column. row['name'] returns the value itself and password columns
+    read as None. Use edit() for a Dict that can be written.
+    """
+    __slots__ = ('_columns', '_values')
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, key):
+        columns = self._columns
+        if key in columns.hidden:
+            return None
+        value = self._values[columns.index[key]]
+        if key in columns.related:
+            return columns.related[key].get(value)
+        return value
+
+    def __setitem__(self, key, value):
+        raise exceptions.ValidationError("Row is read only, use edit()")
+
+    def _set(self, v, validate=True):
+        raise exceptions.ValidationError("Row is read only, use edit()")
+
+    def __contains__(self, key):
+        return key in self._columns.index
+
+    def __iter__(self):
+        return iter(self._columns.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __str__(self):
+        return str(self.value())
+
+    def __repr__(self):
+        return repr(self.value())
+
+    def get(self, key, default=None):
+        if key in self._columns.index:
+            return self[key]
+        return default
+
+    def keys(self):
+        return list(self._columns.names)
+
+    def value(self):
+        return OrderedDict((name, self[name]) for name in self._columns.names)
+
+    def dump(self):
+        """Plain values as Field.dump() returns them."""
+        columns = self._columns
+        result = OrderedDict()
+        for name, value in zip(columns.names, self._values):
+            if name in columns.hidden:
+                value = None
+            elif name in columns.related:
+                value = columns.related[name].get(value)
+                if value is not None:
+                    value = value.dump()
+            elif isinstance(value, datetime):
+                value = value.strftime(_DATETIME)
+            elif name in columns.json:
+                if value is not None and value.strip() != '':
+                    value = json.loads(value)
+                else:
+                    value = None
+            result[name] = value
+        return result
+
+    def edit(self):
+        """Dict of the model holding this row."""
+        model = self._columns.model
+        data = dict(zip(self._columns.names, self._values))
+        if isinstance(model, Fields.List):
+            return model._row(data, False)
+        # Prefetched foreign key sub model.
+        new = copy(model)
+        new._load(data)
+        return new
+
+
+def _rows(model, result, prefetched=None):
+    if len(result) == 0:
+        return []
+    columns = _Columns(model, [name for name in model._declared_fields
+                               if name in result[0]])
+    for name in prefetched or ():
+        keys = list(prefetched[name])
+        rows = _rows(model._declared_fields[name],
+                     [prefetched[name][key] for key in keys])
+        columns.related[name] = dict(zip(keys, rows))
+    rows = []
+    for row in result:
+        values = [row.get(name) for name in columns.names]
+        for i, convert in columns.convert:
+            values[i] = convert(values[i])
+        rows.append(Row(columns, tuple(values)))
+    return rows
+
+
 class Model(Fields, Fields.List):
     pass
 
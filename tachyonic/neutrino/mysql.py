@@ -3,30 +3,358 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import re
 import sys
+import time
 import logging
+import threading
+from collections import deque
+from collections import OrderedDict
 if sys.version[0] == '2':
     import thread
-    from Queue import Queue
 else:
     import _thread as thread
-    from queue import Queue
 
 import pymysql as MySQLdb
 import pymysql.cursors as cursors
 
-from tachyonic.neutrino.utils.general import timer as nfw_timer
+from tachyonic.neutrino import exceptions
+from tachyonic.neutrino import querycache
+from tachyonic.neutrino.utils.general import clock
 
 log = logging.getLogger(__name__)
+slow_log = logging.getLogger(__name__ + '.slow')
+
+# Statements taking longer than this many seconds are logged as warnings
+# to the slow query log. Set with slow_query in [mysql], 0 disables it.
+SLOW_QUERY = 0.1
+
+lock = threading.Lock()
+
+# Execution count and latency per statement text. Statements beyond
+# STATEMENTS_MAX distinct texts are not tracked.
+STATEMENTS_MAX = 1000
+_statements = {}
+_statements_lock = threading.Lock()
+
+# Statements that may be sent to a read replica.
+_READ = re.compile(r'\s*(\(\s*)*SELECT\b', re.I)
+_LOCKING = re.compile(r'\bFOR\s+(UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b',
+                      re.I)
+
+# Client errors meaning the server could not be reached or the connection
+# was lost: can't connect (2002, 2003), server gone away (2006), lost
+# connection (2013, 2055). Only these eject a replica, errors in the
+# query itself are raised as they are.
+_CONNECTION_ERRORS = frozenset((2002, 2003, 2006, 2013, 2055))
+
+# Active profilers by thread, see profile_start().
+_profiles = {}
+
+# Literals replaced when grouping statements by shape.
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b")
+
+# Frames in these modules are skipped when looking for the call site.
+_INTERNAL = set([os.path.splitext(__file__)[0],
+                 os.path.join(os.path.dirname(__file__), 'model')])
+
+# [mysql] settings for the connection pool and their types.
+POOL_OPTIONS = (('pool_min_size', 'min_size', int),
+                ('pool_max_size', 'max_size', int),
+                ('pool_timeout', 'timeout', float),
+                ('pool_idle_timeout', 'idle_timeout', float),
+                ('pool_recycle', 'recycle', float),
+                ('pool_ping_after', 'ping_after', float))
+
+
+def _connection_error(e):
+    """True if e means the server is unreachable rather than a bad query."""
+    if isinstance(e, exceptions.PoolTimeout):
+        return True
+    # Mysql.execute wraps the driver error it gives up on.
+    while (isinstance(e, MySQLdb.Error) and len(e.args) > 0 and
+            isinstance(e.args[0], MySQLdb.Error)):
+        e = e.args[0]
+    return (isinstance(e, MySQLdb.OperationalError) and len(e.args) > 0 and
+            e.args[0] in _CONNECTION_ERRORS)
+
+
+class PooledConnection(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.time()
+        self.last_used = self.created
+
+
+class Pool(object):
+    """Bounded pool of connections for one named database.
+
+    At most max_size connections are open. get() blocks up to timeout
+    seconds for a connection to be returned before raising PoolTimeout.
+    Idle connections above min_size are closed after idle_timeout seconds,
+    connections older than recycle seconds are replaced and connections
+    idle for longer than ping_after seconds are pinged before reuse.
+    """
+    def __init__(self, factory, min_size=0, max_size=20, timeout=30.0,
+                 idle_timeout=600.0, recycle=3600.0, ping_after=60.0):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+
+        self.size = 0
+        self.in_use = 0
+        self.waiters = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.closed = 0
+
+        self._idle = deque()
+        self._cond = threading.Condition(threading.Lock())
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception as e:
+            log.debug("Closing Database Connection failed (%s)" % (e,))
+
+    def _open(self):
+        pooled = PooledConnection(self.factory())
+        self._cond.acquire()
+        try:
+            self.created += 1
+        finally:
+            self._cond.release()
+        return pooled
+
+    def _evict(self, now):
+        # Oldest idle connections are at the left, called with lock held.
+        evicted = []
+        while (len(self._idle) > 0 and self.size > self.min_size and
+                now - self._idle[0].last_used > self.idle_timeout):
+            evicted.append(self._idle.popleft())
+            self.size -= 1
+            self.closed += 1
+        return evicted
+
+    def get(self):
+        started = None
+        pooled = None
+        self._cond.acquire()
+        try:
+            while True:
+                now = time.time()
+                evicted = self._evict(now)
+                if len(self._idle) > 0:
+                    pooled = self._idle.pop()
+                    break
+                elif self.size < self.max_size:
+                    self.size += 1
+                    break
+                if started is None:
+                    started = now
+                remaining = self.timeout - (now - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise exceptions.PoolTimeout("Timed out waiting for" +
+                                                 " database connection")
+                self.waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self.waiters -= 1
+            self.in_use += 1
+            if started is not None:
+                self.waits += 1
+                self.wait_time += time.time() - started
+        finally:
+            self._cond.release()
+
+        for old in evicted:
+            self._close(old)
+
+        try:
+            if pooled is None:
+                return self._open()
+            return self._validate(pooled)
+        except Exception:
+            self._cond.acquire()
+            try:
+                self.size -= 1
+                self.in_use -= 1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            raise
+
+    def _validate(self, pooled):
+        now = time.time()
+        if now - pooled.created > self.recycle:
+            self._close(pooled)
+            self._cond.acquire()
+            try:
+                self.closed += 1
+            finally:
+                self._cond.release()
+            return self._open()
+        elif now - pooled.last_used > self.ping_after:
+            try:
+                pooled.conn.ping(True)
+            except Exception as e:
+                log.error("mysql ping failed, reconnecting (%s)" % (e,))
+                self._close(pooled)
+                self._cond.acquire()
+                try:
+                    self.closed += 1
+                finally:
+                    self._cond.release()
+                return self._open()
+        return pooled
+
+    def put(self, pooled, discard=False):
+        """Return a connection, closing it if discard is True."""
+        now = time.time()
+        self._cond.acquire()
+        try:
+            self.in_use -= 1
+            if discard is True or now - pooled.created > self.recycle:
+                self.size -= 1
+                self.closed += 1
+            else:
+                pooled.last_used = now
+                self._idle.append(pooled)
+                pooled = None
+            evicted = self._evict(now)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+        if pooled is not None:
+            self._close(pooled)
+        for old in evicted:
+            self._close(old)
+
+    def stats(self):
+        self._cond.acquire()
+        try:
+            return {'size': self.size,
+                    'min_size': self.min_size,
+                    'max_size': self.max_size,
+                    'in_use': self.in_use,
+                    'idle': len(self._idle),
+                    'waiters': self.waiters,
+                    'waits': self.waits,
+                    'wait_time': self.wait_time,
+                    'timeouts': self.timeouts,
+                    'created': self.created,
+                    'closed': self.closed}
+        finally:
+            self._cond.release()
+
+
+class Replicas(object):
+    """Selection and health of the read replicas of one primary.
+
+    Replicas are picked round robin or by the fewest connections in use.
+    A replica that can not be reached is ejected for retry seconds. When
+    max_lag is set, replication lag is checked at most every
+    check_interval seconds and replicas that are not replicating or are
+    more than max_lag seconds behind are ejected too.
+    """
+    def __init__(self, names, policy='round_robin', max_lag=None,
+                 check_interval=5.0, retry=30.0):
+        if policy not in ('round_robin', 'least_connections'):
+            raise exceptions.Error("Unknown replica policy '%s'" % (policy,))
+        self.names = names
+        self.policy = policy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry = retry
+        self._next = 0
+        self._ejected = {}
+        self._checked = {}
+        self._unknown = set()
+        self._lock = threading.Lock()
+
+    def healthy(self):
+        now = time.time()
+        return [name for name in self.names
+                if self._ejected.get(name, 0) <= now]
+
+    def select(self, pools):
+        healthy = self.healthy()
+        if len(healthy) == 0:
+            return None
+        if self.policy == 'least_connections':
+            return min(healthy, key=lambda name: pools[name].in_use)
+        self._lock.acquire()
+        try:
+            name = healthy[self._next % len(healthy)]
+            self._next += 1
+        finally:
+            self._lock.release()
+        return name
+
+    def eject(self, name, reason):
+        log.error("mysql replica %s ejected for %s seconds (%s)" %
+                  (name, self.retry, reason))
+        self._ejected[name] = time.time() + self.retry
+
+    def lag_unknown(self, name, reason):
+        """Lag of name can not be checked, it stays in use.
+
+        Logged once, for example when the replica user lacks the
+        REPLICATION CLIENT privilege needed for SHOW SLAVE STATUS.
+        """
+        if name not in self._unknown:
+            self._unknown.add(name)
+            log.error("mysql replica %s lag unknown, not checked (%s)" %
+                      (name, reason))
+
+    def check_due(self, name):
+        if self.max_lag is None:
+            return False
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if now - self._checked.get(name, 0) >= self.check_interval:
+                self._checked[name] = now
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def lag(self, status):
+        """Seconds behind from SHOW SLAVE STATUS, None if not replicating.
+
+        Servers that are not replicas at all report 0.
+        """
+        if len(status) == 0:
+            return 0
+        return status[0].get('Seconds_Behind_Master')
+
+    def stats(self):
+        return {'policy': self.policy,
+                'healthy': self.healthy(),
+                'ejected': [name for name in self.names
+                            if name not in self.healthy()]}
 
 
 class Mysql(object):
     _pool = {}
     _credentials = {}
     _thread = {}
+    _replicas = {}
+    _routes = {}
 
     def __init__(self, name=None, host=None, username=None,
-                 password=None, database=None):
+                 password=None, database=None, **kwargs):
 
         self.thread_id = thread.get_ident()
 
@@ -39,11 +367,66 @@ class Mysql(object):
         self.username = username
         self.password = password
         self.database = database
+        if kwargs.get('slow_query') is not None:
+            slow_query(float(kwargs['slow_query']))
+        self._options = {}
+        for option, arg, cast in POOL_OPTIONS:
+            if kwargs.get(option) is not None:
+                self._options[arg] = cast(kwargs[option])
         self.initialize()
 
+        replicas = kwargs.get('replicas')
+        if replicas and self.name not in self._replicas:
+            self._init_replicas(replicas, kwargs)
+
+    def _init_replicas(self, replicas, kwargs):
+        # replicas is a list of dicts with a name and the credentials
+        # that differ from the primary.
+        options = dict((option, kwargs[option])
+                       for option, arg, cast in POOL_OPTIONS
+                       if kwargs.get(option) is not None)
+        names = []
+        for replica in replicas:
+            name = "%s:%s" % (self.name, replica['name'])
+            Mysql(name,
+                  replica.get('host', self.host),
+                  replica.get('username', self.username),
+                  replica.get('password', self.password),
+                  replica.get('database', self.database),
+                  **options)
+            names.append(name)
+
+        max_lag = kwargs.get('replica_max_lag')
+        if max_lag is not None:
+            max_lag = float(max_lag)
+        lock.acquire()
+        try:
+            if self.name not in self._replicas:
+                self._replicas[self.name] = Replicas(
+                    names,
+                    kwargs.get('replica_policy', 'round_robin'),
+                    max_lag,
+                    float(kwargs.get('replica_check_interval', 5)),
+                    float(kwargs.get('replica_retry', 30)))
+        finally:
+            lock.release()
+
+    def _connect(self):
+        credentials = self._credentials[self.name]
+        return connect(credentials.get('host', '127.0.0.1'),
+                       credentials.get('username', ''),
+                       credentials.get('password', ''),
+                       credentials.get('database', ''))
+
     def initialize(self):
         if self.name not in self._pool:
-            self._pool[self.name] = Queue(maxsize=0)
+            lock.acquire()
+            try:
+                if self.name not in self._pool:
+                    self._pool[self.name] = Pool(self._connect,
+                                                 **self._options)
+            finally:
+                lock.release()
 
         if self.name not in self._credentials:
             self._credentials[self.name] = {}
@@ -61,28 +444,106 @@ class Mysql(object):
         self.password = self._credentials[self.name].get('password', '')
         self.database = self._credentials[self.name].get('database', '')
 
-        if (self.thread_id in self._thread and
-                self.name in self._thread[self.thread_id]):
+    def _connection(self):
+        # Connections are checked out from the pool on first use, so
+        # requests that never query the database cost no round trips.
+        try:
+            return self._thread[self.thread_id][self.name]
+        except KeyError:
             pass
-        else:
-            if self.thread_id not in self._thread:
-                self._thread[self.thread_id] = {}
-            if self._pool[self.name].empty():
-                conn = connect(self.host,
-                               self.username,
-                               self.password,
-                               self.database)
-                conn.ping(True)
-                cursor = conn.cursor(cursors.DictCursor)
-            else:
-                conn = self._pool[self.name].get(True)
 
-                conn.ping(True)
-                cursor = conn.cursor(cursors.DictCursor)
-            self._thread[self.thread_id][self.name] = {}
-            self._thread[self.thread_id][self.name]['db'] = conn
-            self._thread[self.thread_id][self.name]['cursor'] = cursor
-            self._thread[self.thread_id][self.name]['uncommited'] = False
+        if self.thread_id not in self._thread:
+            self._thread[self.thread_id] = {}
+        pooled = self._pool[self.name].get()
+        conn = pooled.conn
+        cursor = conn.cursor(cursors.DictCursor)
+        self._thread[self.thread_id][self.name] = {}
+        self._thread[self.thread_id][self.name]['pooled'] = pooled
+        self._thread[self.thread_id][self.name]['db'] = conn
+        self._thread[self.thread_id][self.name]['cursor'] = cursor
+        self._thread[self.thread_id][self.name]['uncommited'] = False
+        self._thread[self.thread_id][self.name]['written'] = set()
+        return self._thread[self.thread_id][self.name]
+
+    def _checked_out(self):
+        return (self.thread_id in self._thread and
+                self.name in self._thread[self.thread_id])
+
+    def written(self, table):
+        """Mark table as written in the current transaction.
+
+        Cached query results of the table are invalidated now and again
+        when the transaction is committed or rolled back.
+        """
+        querycache.invalidate(table)
+        self._connection()['written'].add(table)
+
+    def writing(self):
+        """True while the current transaction has written any table.
+
+        Results read now may include uncommitted rows, so they are not
+        cached.
+        """
+        return (self._checked_out() and
+                len(self._thread[self.thread_id][self.name]['written']) > 0)
+
+    def _stick(self):
+        # After a write or lock all statements of the request go to the
+        # primary so they see its changes.
+        if self.name in self._replicas:
+            self._routes.setdefault(self.thread_id, {})[self.name] = False
+
+    def _route(self, query):
+        """Replica handle to run query on, None to use the primary."""
+        replicas = self._replicas.get(self.name)
+        if replicas is None:
+            return None
+
+        routes = self._routes.setdefault(self.thread_id, {})
+        route = routes.get(self.name)
+        if route is False:
+            return None
+        if not _READ.match(query) or _LOCKING.search(query):
+            routes[self.name] = False
+            return None
+        if route is not None:
+            return route
+
+        while True:
+            name = replicas.select(self._pool)
+            if name is None:
+                return None
+            replica = Mysql(name)
+            if replicas.check_due(name):
+                try:
+                    lag = replicas.lag(replica.execute("SHOW SLAVE STATUS"))
+                except (MySQLdb.Error, exceptions.PoolTimeout) as e:
+                    if _connection_error(e):
+                        self._eject(replica, e)
+                        continue
+                    replicas.lag_unknown(name, e)
+                else:
+                    if lag is None or lag > replicas.max_lag:
+                        self._eject(replica, "lag %s seconds" % (lag,))
+                        continue
+            routes[self.name] = replica
+            return replica
+
+    def _eject(self, replica, reason):
+        self._replicas[self.name].eject(replica.name, reason)
+        if replica._checked_out():
+            replica._reconnect()
+        routes = self._routes.get(self.thread_id)
+        if routes is not None and routes.get(self.name) is replica:
+            del routes[self.name]
+
+    @staticmethod
+    def stats():
+        """Pool gauges for every named pool."""
+        stats = {}
+        for name in Mysql._pool:
+            stats[name] = Mysql._pool[name].stats()
+        return stats
 
     @staticmethod
     def close_all():
@@ -90,72 +551,157 @@ class Mysql(object):
         if thread_id in Mysql._thread:
             for o in Mysql._thread[thread_id]:
                 db = Mysql._thread[thread_id][o]['db']
+                pooled = Mysql._thread[thread_id][o]['pooled']
                 uncommited = Mysql._thread[thread_id][o]['uncommited']
+                discard = False
                 if uncommited is True:
-                    rollback(db)
-                    # Autocommit neccessary for next request to start new transactions.
-                    # If not applied select queries will return cached results
-                    commit(db)
-                Mysql._pool[o].put_nowait(db)
+                    try:
+                        rollback(db)
+                        # Autocommit neccessary for next request to start new transactions.
+                        # If not applied select queries will return cached results
+                        commit(db)
+                    except MySQLdb.OperationalError as e:
+                        log.error("mysql error, discarding connection (%s)" % (e,))
+                        discard = True
+                _ended(Mysql._thread[thread_id][o]['written'])
+                Mysql._pool[o].put(pooled, discard)
             del Mysql._thread[thread_id]
+        Mysql._routes.pop(thread_id, None)
 
     def close(self):
-        try:
-            if (self.thread_id in self._thread and
-                    self.name in self._thread[self.thread_id]):
-                db = self._thread[self.thread_id][self.name]['db']
-                uncommited = self._thread[self.thread_id][self.name]['uncommited']
-                if uncommited is True:
+        if self._checked_out():
+            db = self._thread[self.thread_id][self.name]['db']
+            pooled = self._thread[self.thread_id][self.name]['pooled']
+            uncommited = self._thread[self.thread_id][self.name]['uncommited']
+            discard = False
+            if uncommited is True:
+                try:
                     rollback(db)
-                self._pool[self.name].put_nowait(db)
-                del self._thread[self.thread_id][self.name]
-        except MySQLdb.OperationalError as e:
+                except MySQLdb.OperationalError as e:
+                    log.error("mysql error, discarding connection (%s)" % (e,))
+                    discard = True
+            _ended(self._thread[self.thread_id][self.name]['written'])
             del self._thread[self.thread_id][self.name]
-            log.error("mysql error" % (e))
+            self._pool[self.name].put(pooled, discard)
+
+    def _reconnect(self):
+        _ended(self._thread[self.thread_id][self.name]['written'])
+        pooled = self._thread[self.thread_id][self.name]['pooled']
+        del self._thread[self.thread_id][self.name]
+        self._pool[self.name].put(pooled, True)
 
     def last_row_id(self):
+        if not self._checked_out():
+            return None
         try:
             cursor = self._thread[self.thread_id][self.name]['cursor']
             return cursor.lastrowid
         except MySQLdb.OperationalError as e:
             log.error("mysql error, attempt to re-initialize (%s)" % (e))
-            del self._thread[self.thread_id][self.name]
-            self.initialize()
+            self._reconnect()
             return None
 
     def last_row_count(self):
+        if not self._checked_out():
+            return None
         try:
             cursor = self._thread[self.thread_id][self.name]['cursor']
             return cursor.rowcount
         except MySQLdb.OperationalError as e:
             log.error("mysql error, attempt to re-initialize (%s)" % (e))
-            del self._thread[self.thread_id][self.name]
-            self.initialize()
+            self._reconnect()
             return None
 
     def _ping(self):
         try:
-            cursor = self._thread[self.thread_id][self.name]['cursor']
+            cursor = self._connection()['cursor']
             execute(cursor, "SELECT VERSION()")
             return True
         except:
             return False
 
+    def _retry(self, e):
+        # Only reconnect when no uncommitted work would be lost.
+        if not self._checked_out():
+            return False
+        conn = self._thread[self.thread_id][self.name]
+        if conn['uncommited'] is False and self._ping() is False:
+            log.error("mysql error, attempt to re-initialize (%s)" % (e))
+            self._reconnect()
+            return True
+        return False
+
     def execute(self, query=None, params=None):
+        replica = self._route(query)
+        if replica is not None:
+            try:
+                return replica.execute(query, params)
+            except (MySQLdb.OperationalError, exceptions.PoolTimeout) as e:
+                if not _connection_error(e):
+                    raise
+                self._eject(replica, e)
+                return self.execute(query, params)
+
         try:
-            cursor = self._thread[self.thread_id][self.name]['cursor']
-            result = execute(cursor, query, params)
-            self._thread[self.thread_id][self.name]['uncommited'] = True
+            conn = self._connection()
+            result = execute(conn['cursor'], query, params)
+            conn['uncommited'] = True
             return result
         except MySQLdb.OperationalError as e:
-            if self._ping is False:
-                log.error("mysql error, attempt to re-initialize (%s)" % (e))
-                del self._thread[self.thread_id][self.name]
-                self.initialize()
-                return execute(self, query, params)
+            if self._retry(e):
+                return self.execute(query, params)
             else:
                 raise MySQLdb.OperationalError(e)
 
+    def executemany(self, query=None, params=None, batch_size=1000):
+        """Execute query once for every sequence of parameters in params.
+
+        Parameters are sent batch_size at a time; PyMySQL rewrites
+        INSERT ... VALUES statements into one multi row INSERT per batch.
+        Returns the number of affected rows.
+        """
+        self._stick()
+        conn = self._connection()
+        params = list(params)
+        rows = 0
+        try:
+            for start in range(0, len(params), batch_size):
+                rows += executemany(conn['cursor'], query,
+                                    params[start:start + batch_size])
+                conn['uncommited'] = True
+            return rows
+        except MySQLdb.OperationalError as e:
+            if rows == 0 and self._retry(e):
+                return self.executemany(query, params, batch_size)
+            else:
+                raise MySQLdb.OperationalError(e)
+
+    def stream(self, query=None, params=None, batch_size=1000, tuples=False):
+        """Iterate over the rows of query without buffering the result.
+
+        Rows are read from an unbuffered server side cursor batch_size
+        at a time. With tuples set rows are tuples instead of dicts.
+        No other query may run on this connection until the iterator is
+        exhausted or closed.
+        """
+        replica = self._route(query)
+        if replica is not None:
+            for row in replica.stream(query, params, batch_size, tuples):
+                yield row
+            return
+
+        conn = self._connection()
+        if tuples is True:
+            cursor = conn['db'].cursor(cursors.SSCursor)
+        else:
+            cursor = conn['db'].cursor(cursors.SSDictCursor)
+        conn['uncommited'] = True
+        try:
+            for row in stream(cursor, query, params, batch_size):
+                yield row
+        finally:
+            cursor.close()
+
     def fields(self, table):
         fields = {}
         result = self.execute("DESCRIBE %s" % (table,))
@@ -170,59 +716,68 @@ class Mysql(object):
                 lock = "WRITE"
             else:
                 lock = "READ"
-            cursor = self._thread[self.thread_id][self.name]['cursor']
+            self._stick()
+            cursor = self._connection()['cursor']
             query = "LOCK TABLES %s %s" % (table, lock)
             result = execute(cursor, query)
             return result
         except MySQLdb.OperationalError as e:
-            if self._ping is False:
-                log.error("mysql error, attempt to re-initialize (%s)" % (e))
-                del self._thread[self.thread_id][self.name]
-                self.initialize()
-                return lock(self, table, write)
+            if self._retry(e):
+                return self.lock(table, write)
             else:
                 raise MySQLdb.OperationalError(e)
 
     def unlock(self):
         try:
-            cursor = self._thread[self.thread_id][self.name]['cursor']
+            cursor = self._connection()['cursor']
             query = "UNLOCK TABLES"
             result = execute(cursor, query)
             return result
         except MySQLdb.OperationalError as e:
-            if self._ping is False:
-                log.error("mysql error, attempt to re-initialize (%s)" % (e))
-                del self._thread[self.thread_id][self.name]
-                self.initialize()
+            if self._retry(e):
                 return self.unlock()
             else:
                 raise MySQLdb.OperationalError(e)
 
     def commit(self):
+        if not self._checked_out():
+            return
         try:
             db = self._thread[self.thread_id][self.name]['db']
             if self._thread[self.thread_id][self.name]['uncommited'] is True:
                 commit(db)
                 self._thread[self.thread_id][self.name]['uncommited'] = False
+                _ended(self._thread[self.thread_id][self.name]['written'])
         except MySQLdb.OperationalError as e:
             log.error("mysql error, attempt to re-initialize (%s)" % (e))
-            del self._thread[self.thread_id][self.name]
-            self.initialize()
+            self._reconnect()
             self.commit()
 
     def rollback(self):
+        if not self._checked_out():
+            return
         try:
             db = self._thread[self.thread_id][self.name]['db']
             rollback(db)
             commit(db)
             self._thread[self.thread_id][self.name]['uncommited'] = False
+            _ended(self._thread[self.thread_id][self.name]['written'])
         except MySQLdb.OperationalError as e:
             log.error("mysql error, attempt to re-initialize (%s)" % (e))
-            del self._thread[self.thread_id][self.name]
-            self.initialize()
+            self._reconnect()
             self.rollback()
 
 
+def _ended(written):
+    # Results cached while the transaction was open may be missing its
+    # writes, or hold them after a rollback, so the tables it wrote are
+    # invalidated again.
+    tables = list(written)
+    written.clear()
+    for table in tables:
+        querycache.invalidate(table)
+
+
 def _log_query(query=None, params=None):
     try:
         if isinstance(params, tuple):
@@ -237,12 +792,64 @@ def _log_query(query=None, params=None):
     return log_query
 
 
+class _Query(object):
+    """Query interpolated with its params only when a record is emitted."""
+    __slots__ = ('query', 'params')
+
+    def __init__(self, query, params=None):
+        self.query = query
+        self.params = params
+
+    def __str__(self):
+        query = _log_query(self.query, self.params)
+        if not isinstance(query, str):
+            query = query.encode('utf-8')
+        return query
+
+    def __unicode__(self):
+        return _log_query(self.query, self.params)
+
+
+def slow_query(seconds):
+    """Set the slow query log threshold, 0 disables it."""
+    global SLOW_QUERY
+    SLOW_QUERY = seconds
+
+
+def _log(event, query, params, duration, rows=None):
+    if SLOW_QUERY and duration > SLOW_QUERY:
+        slow_log.warning("SQL !SLOW! %s %s (ROWS: %s) (DURATION: %.6f)",
+                         event, _Query(query, params), rows, duration,
+                         extra={'sql': query,
+                                'sql_params': params,
+                                'sql_rows': rows,
+                                'duration': duration})
+    elif log.isEnabledFor(logging.DEBUG):
+        log.debug("SQL %s %s (DURATION: %.6f)",
+                  event, _Query(query, params), duration)
+
+
+def _log_transaction(event, db, duration):
+    if SLOW_QUERY and duration > SLOW_QUERY:
+        slow_log.warning("SQL !SLOW! %s (%s,%s,%s) (DURATION: %.6f)",
+                         event, db.get_server_info(), db.get_host_info(),
+                         db.thread_id, duration,
+                         extra={'sql': event.upper(),
+                                'sql_params': None,
+                                'sql_rows': None,
+                                'duration': duration})
+    elif log.isEnabledFor(logging.DEBUG):
+        log.debug("SQL %s (%s,%s,%s) (DURATION: %.6f)",
+                  event, db.get_server_info(), db.get_host_info(),
+                  db.thread_id, duration)
+
+
 def connect(host, username, password, database):
-    timer = nfw_timer()
-    log.debug("Connecting Database Connection" +
-              " (server=%s,username=%s,database=%s)" %
-              (host, username,
-               database))
+    started = clock()
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Connecting Database Connection" +
+                  " (server=%s,username=%s,database=%s)",
+                  host, username, database)
     conn = MySQLdb.connect(host=host,
                            user=username,
                            passwd=password,
@@ -250,91 +857,202 @@ def connect(host, username, password, database):
                            use_unicode=True,
                            charset='utf8',
                            autocommit=False)
-    timer = nfw_timer(timer)
-    log.debug("Connected Database Connection" +
-              " (server=%s,username=%s,database=%s,%s,%s,%s)" %
-              (host,
-               username,
-               database,
-               conn.get_server_info(),
-               conn.get_host_info(),
-               conn.thread_id) +
-              " (DURATION: %s)" % (timer))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Connected Database Connection" +
+                  " (server=%s,username=%s,database=%s,%s,%s,%s)" +
+                  " (DURATION: %.6f)",
+                  host, username, database,
+                  conn.get_server_info(),
+                  conn.get_host_info(),
+                  conn.thread_id,
+                  clock() - started)
     return conn
 
 
+def _parse(params):
+    if params is None:
+        return []
+    return [(1 if param else 0) if param.__class__ is bool else param
+            for param in params]
+
+
+class Profiler(object):
+    """Statements executed by one thread while profiling.
+
+    Statements are grouped by shape, the SQL with literals replaced, and
+    shapes executed repeat or more times are reported as repeated, the
+    typical sign of N+1 queries.
+    """
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.statements = []
+
+    def add(self, query, duration, rows):
+        frame = sys._getframe(2)
+        while (frame.f_back is not None and
+                os.path.splitext(frame.f_code.co_filename)[0] in _INTERNAL):
+            frame = frame.f_back
+        site = "%s:%s" % (frame.f_code.co_filename, frame.f_lineno)
+        self.statements.append((query, duration, rows, site))
+
+    def summary(self):
+        duration = 0.0
+        rows = 0
+        shapes = OrderedDict()
+        for query, elapsed, count, site in self.statements:
+            duration += elapsed
+            rows += count or 0
+            shape = _LITERALS.sub('?', query)
+            if shape not in shapes:
+                shapes[shape] = {'sql': shape,
+                                 'count': 0,
+                                 'duration': 0.0,
+                                 'sites': []}
+            stats = shapes[shape]
+            stats['count'] += 1
+            stats['duration'] += elapsed
+            if site not in stats['sites']:
+                stats['sites'].append(site)
+
+        repeated = [stats for stats in shapes.values()
+                    if stats['count'] >= self.repeat]
+        return {'queries': len(self.statements),
+                'duration': duration,
+                'rows': rows,
+                'repeated': repeated}
+
+
+def profile_start(repeat=3):
+    """Start profiling statements executed by the current thread."""
+    profiler = Profiler(repeat)
+    _profiles[thread.get_ident()] = profiler
+    return profiler
+
+
+def profile_stop():
+    """Stop profiling the current thread, returns its Profiler or None."""
+    return _profiles.pop(thread.get_ident(), None)
+
+
+def _record(query, duration, rows=None):
+    if _profiles:
+        profiler = _profiles.get(thread.get_ident())
+        if profiler is not None:
+            profiler.add(query, duration, rows)
+
+    stats = _statements.get(query)
+    _statements_lock.acquire()
+    try:
+        if stats is None:
+            if len(_statements) >= STATEMENTS_MAX:
+                return
+            stats = _statements.setdefault(query, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += duration
+        if duration > stats[2]:
+            stats[2] = duration
+    finally:
+        _statements_lock.release()
+
+
+def statements():
+    """Execution count and latency in seconds per statement."""
+    _statements_lock.acquire()
+    try:
+        return dict((query, {'count': count,
+                             'total': total,
+                             'average': total / count,
+                             'max': maximum})
+                    for query, (count, total, maximum)
+                    in _statements.items())
+    finally:
+        _statements_lock.release()
+
+
+def reset_statements():
+    _statements_lock.acquire()
+    try:
+        _statements.clear()
+    finally:
+        _statements_lock.release()
+
+
 def execute(cursor, query=None, params=None):
-    timer = nfw_timer()
-
-    parsed = []
-    if params is not None:
-        for param in params:
-            if isinstance(param, bool):
-                if param is True:
-                    parsed.append(1)
-                else:
-                    parsed.append(0)
-            else:
-                parsed.append(param)
+    started = clock()
 
-    log_query = _log_query(query, parsed)
+    parsed = _parse(params)
 
     try:
         cursor.execute(query, parsed)
     except MySQLdb.IntegrityError as e:
         code, value = e
-        log.error("SQL Query %s" % (log_query))
+        log.error("SQL Query %s", _Query(query, parsed))
         raise MySQLdb.IntegrityError(code, value)
 
     result = cursor.fetchall()
 
-    timer = nfw_timer(timer)
-    if timer > 0.1:
-        log.debug("SQL !SLOW! Query %s (DURATION: %s)" % (log_query, timer))
-    else:
-        log.debug("SQL Query %s (DURATION: %s)" % (log_query, timer))
+    duration = clock() - started
+    _record(query, duration, len(result))
+    _log('Query', query, parsed, duration, len(result))
 
     return result
 
 
+def executemany(cursor, query=None, params=None):
+    started = clock()
+
+    parsed = [_parse(p) for p in params]
+
+    try:
+        rows = cursor.executemany(query, parsed)
+    except MySQLdb.IntegrityError as e:
+        code, value = e
+        log.error("SQL Query %s", query)
+        raise MySQLdb.IntegrityError(code, value)
+
+    duration = clock() - started
+    _record(query, duration, rows)
+    _log('Query (BATCH: %s)' % (len(parsed),), query, None, duration, rows)
+
+    return rows or 0
+
+
+def stream(cursor, query=None, params=None, batch_size=1000):
+    started = clock()
+
+    parsed = _parse(params)
+
+    try:
+        cursor.execute(query, parsed)
+    except MySQLdb.IntegrityError as e:
+        code, value = e
+        log.error("SQL Query %s", _Query(query, parsed))
+        raise MySQLdb.IntegrityError(code, value)
+
+    rows = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        rows += len(batch)
+        for row in batch:
+            yield row
+
+    duration = clock() - started
+    _record(query, duration, rows)
+    _log('Stream', query, parsed, duration, rows)
+
+
 def commit(db):
-    timer = nfw_timer()
+    started = clock()
     db.commit()
-    timer = nfw_timer(timer)
-    if timer > 0.1:
-        log.debug("SQL !SLOW! Commit" +
-                  " (%s,%s,%s) (DURATION: %s)" %
-                  (db.get_server_info(),
-                   db.get_host_info(),
-                   db.thread_id,
-                   timer))
-    else:
-        log.debug("SQL Commit" +
-                  "(%s,%s,%s) (DURATION: %s)" %
-                  (db.get_server_info(),
-                   db.get_host_info(),
-                   db.thread_id,
-                   timer))
+    _log_transaction('Commit', db, clock() - started)
 
 
 def rollback(db):
-    timer = nfw_timer()
+    started = clock()
     db.rollback()
-    timer = nfw_timer(timer)
-    if timer > 0.1:
-        log.debug("SQL !SLOW! Rollback" +
-                  " (%s,%s,%s) (DURATION: %s)" %
-                  (db.get_server_info(),
-                   db.get_host_info(),
-                   db.thread_id,
-                   timer))
-    else:
-        log.debug("SQL Rollback" +
-                  " (%s,%s,%s) (DURATION: %s)" %
-                  (db.get_server_info(),
-                   db.get_host_info(),
-                   db.thread_id,
-                   timer))
+    _log_transaction('Rollback', db, clock() - started)
 
 
 class Testing():
@@ -343,6 +1061,7 @@ class Testing():
         self.execute_count = 0
         self._last_row_id = None
         self._last_row_count = None
+        self._written = set()
 
     def last_row_id(self):
         return self._last_row_id
@@ -364,9 +1083,17 @@ class Testing():
     def commit(self):
         if len(self.queries) != self.execute_count:
             raise Exception("Not all test sql queries executed")
+        _ended(self._written)
 
     def rollback(self):
-        pass
+        _ended(self._written)
+
+    def written(self, table):
+        querycache.invalidate(table)
+        self._written.add(table)
+
+    def writing(self):
+        return len(self._written) > 0
 
     def execute(self, query, values=None):
         q = self._query()
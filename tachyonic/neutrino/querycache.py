@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+import logging
+import hashlib
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from tachyonic.neutrino.utils.lru import LRU
+
+log = logging.getLogger(__name__)
+
+# Query results of models declaring Meta.cache_ttl. Keys include a per
+# table generation which writes to the table increment, so results read
+# before a write are not returned after it and simply age out of the LRU.
+# The key is taken before the database is read, a result that is stored
+# after an invalidation is stored under the old generation.
+_cache = LRU(1024)
+_generations = {}
+_lock = threading.Lock()
+
+# Optional Redis client shared by all processes, see configure().
+_redis = None
+_prefix = 'neutrino:query'
+
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def configure(size=1024, redis=None):
+    """Set the size of the process cache and the optional Redis client.
+
+    With a Redis client results and table generations are kept in Redis
+    so all processes share the cache and its invalidation. Resets the
+    hit rate counters.
+    """
+    global _cache
+    global _redis
+    _cache = LRU(size)
+    _redis = redis
+    for stat in _stats:
+        _stats[stat] = 0
+
+
+def key(table, sql, params=None):
+    """Key of sql with params at the current generation of table.
+
+    Take the key before reading the database and pass it to both get()
+    and put().
+    """
+    if params is not None:
+        params = tuple(params)
+    return (table, _generation(table), sql, params)
+
+
+def _redis_key(key):
+    digest = hashlib.md5(repr(key[2:]).encode('utf-8')).hexdigest()
+    return "%s:%s:%s:%s" % (_prefix, key[0], key[1], digest)
+
+
+def _generation(table):
+    if _redis is not None:
+        return int(_redis.get("%s:%s" % (_prefix, table)) or 0)
+    return _generations.get(table, 0)
+
+
+def _count(stat):
+    _lock.acquire()
+    try:
+        _stats[stat] += 1
+    finally:
+        _lock.release()
+
+
+def get(key):
+    """Cached result for key or None."""
+    if _redis is not None:
+        value = _redis.get(_redis_key(key))
+        if value is not None:
+            _count('hits')
+            return pickle.loads(value)
+    else:
+        value = _cache.get(key)
+        if value is not None:
+            expires, result = value
+            if expires > time.time():
+                _count('hits')
+                return result
+    _count('misses')
+    return None
+
+
+def put(key, result, ttl):
+    if _redis is not None:
+        _redis.setex(_redis_key(key), int(ttl), pickle.dumps(result, 2))
+    else:
+        _cache[key] = (time.time() + ttl, result)
+
+
+def invalidate(table):
+    """Forget cached results of queries on table."""
+    if _redis is not None:
+        _redis.incr("%s:%s" % (_prefix, table))
+    _lock.acquire()
+    try:
+        _generations[table] = _generations.get(table, 0) + 1
+        _stats['invalidations'] += 1
+    finally:
+        _lock.release()
+
+
+def stats():
+    hits = _stats['hits']
+    misses = _stats['misses']
+    if hits + misses > 0:
+        hit_rate = hits / (hits + misses)
+    else:
+        hit_rate = 0.0
+    cache = _cache.stats()
+    return {'hits': hits,
+            'misses': misses,
+            'hit_rate': hit_rate,
+            'invalidations': _stats['invalidations'],
+            'entries': cache['entries'],
+            'evictions': cache['evictions'],
+            'redis': _redis is not None}
@@ -3,16 +3,122 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
 import logging
+import threading
+
 import redis as rd
 
 log = logging.getLogger(__name__)
 
+lock = threading.Lock()
+
+# Process wide client, re-created when the pid changes after a fork.
+_client = None
+_pid = None
+
+
+class _Counting(object):
+    # Counts checkouts to report reuse.
+    def __init__(self, **kwargs):
+        super(_Counting, self).__init__(**kwargs)
+        self.checkouts = 0
+        self._checkouts_lock = threading.Lock()
+
+    def get_connection(self, command_name, *keys, **options):
+        self._checkouts_lock.acquire()
+        try:
+            self.checkouts += 1
+        finally:
+            self._checkouts_lock.release()
+        return super(_Counting, self).get_connection(command_name,
+                                                     *keys,
+                                                     **options)
+
+
+class ConnectionPool(_Counting, rd.ConnectionPool):
+    """Unbounded Redis connection pool counting checkouts."""
+    def usage(self):
+        """Connections created, in use and idle."""
+        return (self._created_connections,
+                len(self._in_use_connections),
+                len(self._available_connections))
+
+
+class BlockingConnectionPool(_Counting, rd.BlockingConnectionPool):
+    """Redis connection pool of at most max_connections connections.
+
+    Waits up to timeout seconds for a connection to be released instead
+    of failing with too many connections.
+    """
+    def usage(self):
+        """Connections created, in use and idle."""
+        created = len(self._connections)
+        idle = len([conn for conn in list(self.pool.queue)
+                    if conn is not None])
+        return (created, created - idle, idle)
+
+
+def _float(value):
+    if value is not None:
+        return float(value)
+    return None
+
 
 def redis(config):
-    redis_config = config.get('redis')
-    host = redis_config.get('server', 'localhost')
-    port = redis_config.get('port', 6379)
-    db = redis_config.get('db', 0)
+    global _client
+    global _pid
+
+    pid = os.getpid()
+    if _client is not None and _pid == pid:
+        return _client
+
+    lock.acquire()
+    try:
+        if _client is None or _pid != pid:
+            redis_config = config.get('redis')
+            host = redis_config.get('server', 'localhost')
+            port = int(redis_config.get('port', 6379))
+            db = int(redis_config.get('db', 0))
+            max_connections = redis_config.get('max_connections')
+            if max_connections is not None:
+                max_connections = int(max_connections)
+            socket_timeout = _float(redis_config.get('socket_timeout'))
+            connect_timeout = _float(redis_config.get('socket_connect_timeout'))
+
+            if max_connections is not None:
+                pool = BlockingConnectionPool(
+                    host=host, port=port, db=db,
+                    max_connections=max_connections,
+                    timeout=float(redis_config.get('pool_timeout', 20)),
+                    socket_timeout=socket_timeout,
+                    socket_connect_timeout=connect_timeout)
+            else:
+                pool = ConnectionPool(host=host, port=port, db=db,
+                                      socket_timeout=socket_timeout,
+                                      socket_connect_timeout=connect_timeout)
+            log.debug("Redis connection pool (server=%s,port=%s,db=%s,pid=%s)" %
+                      (host, port, db, pid))
+            _client = rd.StrictRedis(connection_pool=pool)
+            _pid = pid
+        return _client
+    finally:
+        lock.release()
+
+
+def stats():
+    """Connection statistics of the current process pool.
+
+    Returns None if no pool has been created in this process yet.
+    """
+    if _client is None or _pid != os.getpid():
+        return None
 
-    return rd.StrictRedis(host=host, port=port, db=db)
+    pool = _client.connection_pool
+    created, in_use, idle = pool.usage()
+    return {'max_connections': pool.max_connections,
+            'created': created,
+            'in_use': in_use,
+            'idle': idle,
+            'checkouts': pool.checkouts,
+            'reused': max(pool.checkouts - created, 0)}
@@ -62,7 +62,8 @@ class Request(object):
             super(Request, self).__setattr__(name, value.upper())
         elif name[0] == '_':
             super(Request, self).__setattr__(name, value)
-        elif name == 'args' or name == 'view' or name == 'policy':
+        elif (name == 'args' or name == 'view' or name == 'policy' or
+                name == 'profiler'):
             super(Request, self).__setattr__(name, value)
         elif hasattr(self, name):
             raise AttributeError("'request' object can't rebind" +
@@ -3,16 +3,19 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import logging
+import traceback
+from datetime import date
+from datetime import datetime
+from decimal import Decimal
 
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
+from io import BytesIO
 
 from tachyonic.neutrino import constants as const
 from tachyonic.neutrino.headers import Headers
 from tachyonic.neutrino.utils.general import if_unicode_to_utf8
+from tachyonic.neutrino.utils.general import json_array
 from tachyonic.neutrino import router
 
 log = logging.getLogger(__name__)
@@ -69,14 +72,24 @@ def http_permanent_redirect(url, req, resp):
 
 
 class Response(object):
+    """Response to a request.
+
+    The body is kept as the list of byte strings written, which is
+    handed to the WSGI server as is. With chunk_size the body is sent
+    in chunks of roughly chunk_size bytes instead, joining small writes
+    and splitting large ones.
+    """
     _attributes = ['status']
 
-    def __init__(self, req=None):
+    def __init__(self, req=None, chunk_size=None):
         self.status = const.HTTP_200
         super(Response, self).__setattr__('headers', Headers(request=False))
         self.headers['Content-Type'] = const.TEXT_HTML
-        super(Response, self).__setattr__('_io', StringIO())
+        super(Response, self).__setattr__('_body', [])
+        super(Response, self).__setattr__('_io', None)
         super(Response, self).__setattr__('content_length', 0)
+        super(Response, self).__setattr__('_stream', None)
+        super(Response, self).__setattr__('_chunk_size', chunk_size)
         super(Response, self).__setattr__('_req', req)
         self.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         self.headers['Progma'] = 'no-cache'
@@ -87,40 +100,85 @@ class Response(object):
             super(Response, self).__setattr__(name, value)
         elif name == 'body':
             self.clear()
-            super(Response, self).__setattr__('_io', StringIO())
             self.write(value)
         else:
             AttributeError("'response' object can't bind" +
                            " attribute '%s'" % (name,))
 
+    def _reader(self):
+        # File like access joins the body once, writing discards it.
+        if self._io is None:
+            super(Response, self).__setattr__('_io',
+                                              BytesIO(b''.join(self._body)))
+        return self._io
+
     def seek(self,position):
-        self._io.seek(position)
+        self._reader().seek(position)
 
     def read(self, size=0):
         if size == 0:
-            return self._io.read()
+            return self._reader().read()
         else:
-            return self._io.read(size)
+            return self._reader().read(size)
 
     def readline(self, size=0):
         if size == 0:
-            return self._io.readline()
+            return self._reader().readline()
         else:
-            return self._io.readline(size)
+            return self._reader().readline(size)
 
     def write(self, data):
         data = if_unicode_to_utf8(data)
         super(Response, self).__setattr__('content_length',
                                           len(data)+self.content_length)
-        self._io.write(data)
+        self._body.append(data)
+        if self._io is not None:
+            super(Response, self).__setattr__('_io', None)
 
     def clear(self):
         super(Response, self).__setattr__('content_length', 0)
-        super(Response, self).__setattr__('_io', StringIO())
+        super(Response, self).__setattr__('_body', [])
+        super(Response, self).__setattr__('_io', None)
+        super(Response, self).__setattr__('_stream', None)
+
+    def chunks(self):
+        """Body for the WSGI server."""
+        if self._chunk_size is None:
+            return self._body
+        return rechunk(self._body, self._chunk_size)
 
     def __iter__(self):
-        self._io.seek(0)
-        return response_io_stream(self._io)
+        return iter(self.chunks())
+
+    def stream(self, chunks):
+        """Send the chunks iterable as the body without buffering it.
+
+        The body is sent without Content-Length and the request cleanup,
+        such as returning database connections, waits until the server
+        has sent the last chunk.
+        """
+        self.clear()
+        super(Response, self).__setattr__('_stream', chunks)
+
+    def stream_json(self, rows, size=100, **kwargs):
+        """Stream rows as a JSON array encoded size rows at a time.
+
+        rows is a Model list or an iterable of dictionaries such as
+        Mysql.stream(), so rows can be sent while still being fetched.
+        """
+        self.headers['Content-Type'] = const.APPLICATION_JSON
+        if hasattr(rows, 'iter_json'):
+            self.stream(rows.iter_json(size, **kwargs))
+        else:
+            self.stream(iter_json(rows, size, **kwargs))
+
+    @property
+    def streaming(self):
+        return self._stream is not None
+
+    def stream_body(self, close=None):
+        """Iterable for the WSGI server running close when done."""
+        return _Stream(self._stream, close)
 
     def view(self, url, method):
         self.clear()
@@ -131,15 +189,70 @@ class Response(object):
         http_see_other(url, self._req, self)
 
 
-def response_io_stream(f, chunk_size=None):
-    '''
-    Generator to buffer chunks
-    '''
-    while True:
-        if chunk_size is None:
-            chunk = f.read()
-        else:
-            chunk = f.read(chunk_size)
-        if not chunk:
-            break
-        yield if_unicode_to_utf8(chunk)
+class _Stream(object):
+    # WSGI servers call close() once the body is sent or the client is
+    # gone, also after an error while iterating.
+    def __init__(self, chunks, close=None):
+        self._chunks = chunks
+        self._close = close
+
+    def __iter__(self):
+        try:
+            for chunk in self._chunks:
+                yield if_unicode_to_utf8(chunk)
+        except Exception as e:
+            trace = str(traceback.format_exc())
+            log.error("Streaming response failed %s\n%s" % (e, trace))
+            raise
+
+    def close(self):
+        try:
+            if hasattr(self._chunks, 'close'):
+                self._chunks.close()
+        finally:
+            if self._close is not None:
+                self._close()
+
+
+def _json_default(o):
+    if isinstance(o, datetime):
+        return o.strftime("%Y/%m/%d %H:%M:%S")
+    elif isinstance(o, date):
+        return o.strftime("%Y/%m/%d")
+    elif isinstance(o, Decimal):
+        return float(o)
+    raise TypeError("%r is not JSON serializable" % (o,))
+
+
+def iter_json(rows, size=100, **kwargs):
+    """JSON array of rows in chunks of size rows."""
+    kwargs.setdefault('default', _json_default)
+    encoder = json.JSONEncoder(**kwargs)
+    return json_array(rows, encoder.encode, encoder.item_separator, size)
+
+
+def rechunk(chunks, size):
+    """Byte string chunks of roughly size bytes.
+
+    Chunks smaller than size are joined until at least size bytes are
+    pending and larger ones are split.
+    """
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        if len(chunk) >= size:
+            if pending_size > 0:
+                yield b''.join(pending)
+                pending = []
+                pending_size = 0
+            for start in range(0, len(chunk), size):
+                yield chunk[start:start + size]
+        elif len(chunk) > 0:
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= size:
+                yield b''.join(pending)
+                pending = []
+                pending_size = 0
+    if pending_size > 0:
+        yield b''.join(pending)
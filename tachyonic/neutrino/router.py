@@ -7,10 +7,15 @@ import logging
 import re
 import keyword
 
-import tachyonic.neutrino
+from tachyonic.neutrino import exceptions
+from tachyonic.neutrino.utils.lru import LRU
 
 log = logging.getLogger(__name__)
 
+_WHITESPACE = re.compile(r'\s')
+_FIELD = re.compile('{([^}]*)}')
+_IDENTIFIER = re.compile('[A-Za-z_][A-Za-z0-9_]+$')
+
 
 def view(uri, method, req, resp):
     req.method = method
@@ -21,13 +26,77 @@ def view(uri, method, req, resp):
         method, route, obj, name = route
         obj(req, resp, **obj_kwargs)
     else:
-        raise tachyonic.neutrino.HTTPNotFound(description=uri)
+        raise exceptions.HTTPNotFound(description=uri)
 
 
-class Router(object):
+class _Node(object):
+    """Segment trie node.
+
+    Children are looked up by exact segment first, then by '{param}'
+    captures in the order they were added and lastly the '*' wildcard
+    which consumes the remainder of the path.
+    """
+    __slots__ = ('static', 'params', 'wildcard', 'route')
+
     def __init__(self):
+        self.static = {}
+        self.params = []
+        self.wildcard = None
+        self.route = None
+
+
+def _canonical(route):
+    # Capture names do not change what a route matches.
+    return _FIELD.sub('{}', route)
+
+
+def _walk(node, segments, index, kwargs):
+    if index == len(segments):
+        if node.route is not None:
+            return [node.route, kwargs]
+    else:
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            found = _walk(child, segments, index + 1, kwargs)
+            if found is not None:
+                return found
+        for name, child in node.params:
+            params = kwargs.copy()
+            params[name] = segment
+            found = _walk(child, segments, index + 1, params)
+            if found is not None:
+                return found
+
+    if node.wildcard is not None:
+        return [node.wildcard, kwargs]
 
+    return None
+
+
+class Router(object):
+    def __init__(self, cache_size=0):
         self.routes = []
+        self._tree = {}
+        self._index = set()
+        self._cache = None
+        self.cache(cache_size)
+
+    def cache(self, size):
+        """Enable LRU cache of resolved routes for up to size paths.
+
+        A size of 0 disables the cache.
+        """
+        if size > 0:
+            self._cache = LRU(size)
+        else:
+            self._cache = None
+
+    def cache_info(self):
+        if self._cache is not None:
+            return self._cache.stats()
+        else:
+            return None
 
     def view(self, uri, method, req, resp):
         view(uri, method, req, resp)
@@ -35,54 +104,118 @@ class Router(object):
     def _match(self, method, request_uri):
         # Standard routing below
         if "?" in request_uri:
-            uri, args = request_uri.split('?')
+            uri, args = request_uri.split('?', 1)
             uri = uri.strip('/').split('/')
         else:
             uri = request_uri.split('/')
 
-        for r in self.routes:
-            r_method, r_uri, r_obj, r_name = r
-
-            w_uri = str(r_uri)
-            r_uri = r_uri.split('/')
-            if method == r_method:
-                if '*' in r_uri and w_uri.replace('/*','') in request_uri:
-                    return [r, {}]
-                if len(uri) == len(r_uri):
-                    kwargs = {}
-                    for (i, v) in enumerate(r_uri):
-                        if len(v) > 0 and v[0] == '{':
-                            v = v.replace('{', '').replace('}', '')
-                            kwargs[v] = uri[i]
-                        elif v != uri[i]:
-                            break
-                        if i+1 == len(r_uri):
-                            return [r, kwargs]
-        return None
+        tree = self._tree.get(method)
+        if tree is None:
+            return None
+
+        return _walk(tree, uri, 0, {})
+
+    def _compile(self, r):
+        r_method, r_uri, r_obj, r_name = r
+
+        node = self._tree.get(r_method)
+        if node is None:
+            node = self._tree[r_method] = _Node()
+
+        for segment in r_uri.split('/'):
+            if segment == '*':
+                node.wildcard = r
+                return
+            elif segment[:1] == '{' and segment[-1:] == '}':
+                name = segment[1:-1]
+                for param, child in node.params:
+                    if param == name:
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.params.append((name, child))
+                    node = child
+            else:
+                child = node.static.get(segment)
+                if child is None:
+                    child = node.static[segment] = _Node()
+                node = child
+
+        node.route = r
 
     def route(self, req):
         uri = req.environ['PATH_INFO'].strip('/')
         if uri is None:
             uri = ''
         method = req.method
-        return self._match(method, uri)
 
-    def add(self, method, route, obj, name=None):
-        if re.search('\s', route):
+        if self._cache is None:
+            return self._match(method, uri)
+
+        key = (method, uri)
+        r = self._cache.get(key)
+        if r is None:
+            r = self._match(method, uri)
+            if r is None:
+                return None
+            self._cache[key] = r
+
+        route, kwargs = r
+        return [route, kwargs.copy()]
+
+    def _validate(self, route):
+        if _WHITESPACE.search(route):
             raise ValueError('Route may not include whitespace.')
-        fields = re.findall('{([^}]*)}', route)
+        fields = _FIELD.findall(route)
         for field in fields:
-            is_identifier = re.match('[A-Za-z_][A-Za-z0-9_]+$', field)
+            is_identifier = _IDENTIFIER.match(field)
             if not is_identifier or field in keyword.kwlist:
                 raise ValueError('Field names must be valid identifiers.')
 
         route = route.strip('/')
-        if self._match(method, route) is None:
+        segments = route.split('/')
+        if '*' in segments and segments.index('*') != len(segments) - 1:
+            raise ValueError('Wildcard may only be the last route segment.')
+
+        return route
+
+    def add(self, method, route, obj, name=None):
+        self.add_many(((method, route, obj, name),))
+
+    def add_many(self, routes):
+        """Register several routes at once.
+
+        routes is an iterable of (method, route, obj) or
+        (method, route, obj, name). Nothing is registered if any of the
+        routes is invalid or a duplicate.
+        """
+        new = []
+        keys = set()
+        for route in routes:
+            if len(route) == 3:
+                method, route, obj = route
+                name = None
+            else:
+                method, route, obj, name = route
+
+            route = self._validate(route)
+            key = (method, _canonical(route))
+            if key in self._index or key in keys:
+                raise exceptions.Error('Adding duplicate API route %s' % (route))
+            keys.add(key)
+
             r = list()
             r.append(method)
             r.append(route)
             r.append(obj)
             r.append(name)
+            new.append(r)
+
+        for r in new:
             self.routes.append(r)
-        else:
-            raise tachyonic.neutrino.Error('Adding duplicate API route %s' % (route))
+            self._compile(r)
+        self._index.update(keys)
+
+        if self._cache is not None:
+            self._cache.clear()
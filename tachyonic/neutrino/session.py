@@ -4,11 +4,15 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import errno
 import logging
-import pickle
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import time
-import datetime
-import fcntl
+import hashlib
+import tempfile
 try:
     import _thread as thread
     from http.cookies import SimpleCookie
@@ -18,13 +22,30 @@ except ImportError:
 
 import threading
 
+from tachyonic.neutrino import codec
 from tachyonic.neutrino.headers import Headers
 from tachyonic.neutrino.utils.general import if_unicode_to_utf8
 from tachyonic.neutrino.utils.general import random_id
 
 log = logging.getLogger(__name__)
 
-lock = threading.Lock()
+# Session files are spread over SHARDS sub directories of tmp/sessions
+# named by the first two hex digits of the md5 of the session id. Each
+# shard has its own lock.
+SHARDS = 256
+_locks = [threading.Lock() for i in range(SHARDS)]
+
+
+def _shard(id):
+    return hashlib.md5(if_unicode_to_utf8(id)).hexdigest()[:2]
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
 
 
 class SessionBase(object):
@@ -34,7 +55,11 @@ class SessionBase(object):
         app_config = config.get('application')
         self.use_x_forwarded_host = app_config.get('use_x_forwarded_host', False)
         self._name = None
-        self._expire = app_config.get('session_expire', 3600)
+        self._expire = int(app_config.get('session_expire', 3600))
+        # Minimum seconds between expiry refreshes of sessions that are
+        # read but not modified. 0 refreshes on every request using it.
+        self._refresh = int(app_config.get('session_refresh', 0))
+        self._codec = codec.get(app_config.get('session_codec', 'pickle'))
         self._id = None
         if 'app_root' in kwargs:
             self._path = "%s/tmp/" % (kwargs['app_root'],)
@@ -78,8 +103,6 @@ class SessionBase(object):
         cookie[name]['max-age'] = self._expire
 
         cookie_string = cookie[name].OutputString()
-        if hasattr(self, '_load'):
-            self._load()
         return cookie_string
 
     def save(self):
@@ -87,106 +110,309 @@ class SessionBase(object):
             self._save()
 
 
+def _text(value):
+    if isinstance(value, bytes) and not isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def _value(value):
+    if value == 'True' or value == b'True':
+        return True
+    elif value == 'False' or value == b'False':
+        return False
+    else:
+        return value
+
+
 class SessionRedis(SessionBase):
+    """Redis hash backed session.
+
+    The hash and its TTL are loaded with a single round trip on first
+    access. Changes are kept locally and written back with one pipelined
+    transaction in save(). Sessions that were never used cost no round
+    trips. round_trips counts the Redis round trips made for the request.
+
+    Each value is encoded with the session_codec configured in
+    [application]. Plain strings written by earlier releases are still
+    read, with 'True' and 'False' mapped to booleans.
+    """
+    def __init__(self, config, **kwargs):
+        super(SessionRedis, self).__init__(config, **kwargs)
+        self.round_trips = 0
+        self._cache = None
+        self._ttl = None
+        self._changes = {}
+        self._deleted = set()
+
+    def _data(self):
+        if self._cache is None:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.hgetall(self._name)
+            pipe.ttl(self._name)
+            values, self._ttl = pipe.execute()
+            self.round_trips += 1
+            data = {}
+            for key, value in values.items():
+                data[_text(key)] = codec.decode(value, _value)
+            for key in self._deleted:
+                data.pop(key, None)
+            data.update(self._changes)
+            self._cache = data
+        return self._cache
+
+    def _refresh_due(self):
+        # TTL of -2 means the hash does not exist, -1 that it has no expiry.
+        if self._ttl is None or self._ttl == -2:
+            return False
+        elif self._ttl == -1:
+            return True
+        return self._expire - self._ttl >= self._refresh
+
     def _save(self):
-        self._redis.expire(self._name, self._expire)
+        if len(self._changes) > 0 or len(self._deleted) > 0:
+            pipe = self._redis.pipeline(transaction=True)
+            if len(self._changes) > 0:
+                changes = {}
+                for key in self._changes:
+                    changes[key] = codec.encode(self._codec,
+                                                self._changes[key])
+                pipe.hmset(self._name, changes)
+            if len(self._deleted) > 0:
+                pipe.hdel(self._name, *self._deleted)
+            pipe.expire(self._name, self._expire)
+            pipe.execute()
+        elif self._cache is not None and self._refresh_due():
+            self._redis.expire(self._name, self._expire)
+        else:
+            return
+        self.round_trips += 1
+        self._changes = {}
+        self._deleted = set()
+        log.debug("Session %s (REDIS ROUND TRIPS: %s)" % (self._id,
+                                                           self.round_trips))
 
     def __setitem__(self, key, value):
-        self._redis.hset(self._name, key, value)
-        self._redis.expire(self._name, self._expire)
+        self._changes[key] = value
+        self._deleted.discard(key)
+        if self._cache is not None:
+            self._cache[key] = value
 
     def __getitem__(self, key):
-        val = self._redis.hget(self._name, key)
-        if val == 'True':
-            return True
-        elif val == 'False':
-            return False
-        else:
-            return val
+        return self._data().get(key)
 
     def __delitem__(self, key):
-        self._redis.hdel(self._name, key)
+        self._changes.pop(key, None)
+        self._deleted.add(key)
+        if self._cache is not None:
+            self._cache.pop(key, None)
 
     def __contains__(self, key):
-        return self._redis.hexists(self._name, key)
+        return key in self._data()
 
     def __iter__(self):
-        return iter(self._redis.hgetall(self._name))
+        return iter(list(self._data()))
 
     def __len__(self):
-        return len(self._redis.hlen(self._name))
+        return len(self._data())
 
     def get(self, k, d=None):
-        if k in self:
-            val = self._redis.hget(self._name, k)
-            if val == 'True':
-                return True
-            elif val == 'False':
-                return False
-            else:
-                return val
-        else:
-            return d
+        return self._data().get(k, d)
+
+
+def sweep(path, expire, shards=None):
+    """Remove expired session files below the tmp directory path.
+
+    Walks tmp/sessions one shard at a time so only a single shard listing
+    is held in memory. shards limits the sweep to the given shard names,
+    otherwise all shards and files from the old flat tmp layout are swept.
+    Returns the number of sessions removed.
+    """
+    removed = 0
+    now = int(time.time())
+    sessions = os.path.join(path, 'sessions')
+    if shards is None:
+        shards = ['%02x' % i for i in range(SHARDS)]
+        directories = [path]
+    else:
+        directories = []
+    directories += [os.path.join(sessions, shard) for shard in shards]
+
+    for directory in directories:
+        try:
+            files = os.listdir(directory)
+        except OSError:
+            continue
+        for f in files:
+            if not f.endswith('.session') and not f.endswith('.tmp'):
+                continue
+            fpath = os.path.join(directory, f)
+            try:
+                if now - int(os.stat(fpath).st_mtime) > expire:
+                    os.remove(fpath)
+                    if f.endswith('.session'):
+                        removed += 1
+            except OSError:
+                # Already removed or replaced by another process.
+                pass
+
+    return removed
+
+
+class Sweeper(threading.Thread):
+    """Background thread sweeping one session shard every interval."""
+    def __init__(self, path, expire, interval):
+        super(Sweeper, self).__init__(name='session-sweeper')
+        self.daemon = True
+        self.path = path
+        self.expire = expire
+        self.interval = interval
+        self._halt = threading.Event()
+
+    def run(self):
+        shard = 0
+        while not self._halt.is_set():
+            try:
+                removed = sweep(self.path, self.expire, ['%02x' % shard])
+                if removed > 0:
+                    log.debug("Removed expired sessions: %s (SHARD: %02x)" %
+                              (removed, shard))
+            except Exception as e:
+                log.error("Session sweep failed (%s)" % (e,))
+            shard = (shard + 1) % SHARDS
+            self._halt.wait(self.interval)
+
+    def stop(self):
+        self._halt.set()
 
 
 class SessionFile(SessionBase):
+    """Session file below the application tmp directory.
+
+    The session is encoded with the session_codec configured in
+    [application]. Untagged files written by earlier releases are read as
+    pickles.
+
+    Files are stored in hash prefixed shards (tmp/sessions/<xx>/) and
+    saved by writing a temporary file renamed over the session, so readers
+    never see a partial write. Sessions still in the old flat tmp layout
+    are read and moved into their shard when next saved.
+
+    The file is only read on first access and only rewritten when the
+    session changed. Unchanged sessions have their modification time
+    refreshed according to session_refresh.
+    """
+    def __init__(self, config, **kwargs):
+        super(SessionFile, self).__init__(config, **kwargs)
+        self._session = None
+        self._original = None
+        self._mtime = None
+        self._legacy = False
+
+    def _file(self):
+        return "%ssessions/%s/%s.session" % (self._path, _shard(self._id),
+                                             self._id,)
+
+    def _legacy_file(self):
+        return "%s%s.session" % (self._path, self._id,)
+
+    def _lock(self):
+        return _locks[int(_shard(self._id), 16)]
+
+    def _data(self):
+        if self._session is None:
+            self._load()
+        return self._session
+
+    def _read(self, path):
+        try:
+            stat = os.stat(path)
+            lm = int(stat.st_mtime)
+            if int(time.time()) - lm > self._expire:
+                return None
+            with open(path, 'rb') as h:
+                raw = h.read()
+        except (OSError, IOError):
+            return None
+        # A second copy detects changes, including in place changes of
+        # mutable values, without re-encoding on save.
+        self._session = codec.decode(raw, pickle.loads)
+        self._original = codec.decode(raw, pickle.loads)
+        self._mtime = lm
+        return raw
+
     def _load(self):
+        self._session = {}
+        lock = self._lock()
         lock.acquire()
         try:
-            if os.path.isfile("%s%s.session" % (self._path, self._id,)):
-                ts = int(time.mktime(datetime.datetime.now().timetuple()))
-                stat = os.stat("%s%s.session" % (self._path, self._id))
-                lm = int(stat.st_mtime)
-                if ts - lm > self._expire:
-                    self._session = {}
-
-            if os.path.isfile("%s%s.session" % (self._path, self._id,)):
-                h = open("%s%s.session" % (self._path, self._id,), 'rb', 0)
-                fcntl.flock(h, fcntl.LOCK_EX)
-                try:
-                    self._session = pickle.load(h)
-                finally:
-                    fcntl.flock(h, fcntl.LOCK_UN)
-                    h.close()
-            else:
-                self._session = {}
+            if self._read(self._file()) is None:
+                if self._read(self._legacy_file()) is not None:
+                    self._legacy = True
         finally:
             lock.release()
 
     def _save(self):
+        if self._session is None:
+            return
+
+        if self._session == self._original and self._legacy is False:
+            if int(time.time()) - self._mtime >= self._refresh:
+                try:
+                    os.utime(self._file(), None)
+                except OSError:
+                    pass
+            return
+        elif self._original is None and len(self._session) == 0:
+            return
+
+        raw = codec.encode(self._codec, self._session)
+        path = self._file()
+        directory = os.path.dirname(path)
+        lock = self._lock()
         lock.acquire()
-        h = None
         try:
-            h = open("%s%s.session" % (self._path, self._id,), 'wb', 0)
-            fcntl.flock(h, fcntl.LOCK_EX)
-            pickle.dump(self._session, h)
-            h.flush()
-            fcntl.flock(h, fcntl.LOCK_UN)
+            _makedirs(directory)
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            try:
+                try:
+                    os.write(fd, raw)
+                finally:
+                    os.close(fd)
+                os.rename(tmp, path)
+            except Exception:
+                os.remove(tmp)
+                raise
+            if self._legacy is True:
+                try:
+                    os.remove(self._legacy_file())
+                except OSError:
+                    pass
+                self._legacy = False
         finally:
-            if h is not None:
-                h.close()
             lock.release()
+        self._original = codec.decode(raw)
 
     def __setitem__(self, key, value):
-        self._session[key] = value
+        self._data()[key] = value
 
     def __getitem__(self, key):
-        return self._session[key]
+        return self._data()[key]
 
     def __delitem__(self, key):
         try:
-            del self._session[key]
+            del self._data()[key]
         except KeyError:
             pass
 
     def __contains__(self, key):
-        return key in self._session
+        return key in self._data()
 
     def __iter__(self):
-        return iter(self._session)
+        return iter(self._data())
 
     def __len__(self):
-        return len(self._session)
+        return len(self._data())
 
     def get(self, k, d=None):
-        return self._session.get(k, d)
+        return self._data().get(k, d)
@@ -7,6 +7,20 @@ import datetime
 import string
 import random
 import sys
+import time
+import timeit
+
+# Clock for measuring durations. Python 3 has the monotonic high
+# resolution time.perf_counter. Python 2 has no monotonic clock, so
+# use the optional monotonic package if installed, otherwise
+# timeit.default_timer, which is the wall clock time.time there.
+try:
+    clock = time.perf_counter
+except AttributeError:
+    try:
+        from monotonic import monotonic as clock
+    except ImportError:
+        clock = timeit.default_timer
 
 
 def import_module(module):
@@ -63,3 +77,19 @@ def is_byte_string(string):
             return True
         else:
             return False
+
+
+def json_array(rows, write, separator, size=100):
+    """JSON array of the rows encoded by write, a chunk per size rows."""
+    chunk = ['[']
+    count = 0
+    for row in rows:
+        if count > 0:
+            chunk.append(separator)
+        chunk.append(write(row))
+        count += 1
+        if count % size == 0:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    yield ''.join(chunk)
@@ -21,10 +21,14 @@ from tachyonic.neutrino import template
 from tachyonic.neutrino.utils.general import import_module
 from tachyonic.neutrino.session import SessionFile
 from tachyonic.neutrino.session import SessionRedis
+from tachyonic.neutrino.session import Sweeper
 from tachyonic.neutrino.headers import Headers
 from tachyonic.neutrino.request import Request
 from tachyonic.neutrino.response import Response
+from tachyonic.neutrino import mysql
+from tachyonic.neutrino import querycache
 from tachyonic.neutrino.mysql import Mysql
+from tachyonic.neutrino.redissy import redis
 from tachyonic.client.restclient import RestClient
 from tachyonic.neutrino import constants as const
 from tachyonic.neutrino import exceptions
@@ -40,6 +44,68 @@ root.jinja = template.Jinja()
 root.render_template = root.jinja.render_template
 
 
+class Runtime(object):
+    """Application settings resolved once per process.
+
+    Built by Wsgi.__call__ so the request path only does request specific
+    work. Attributes can't be rebound after construction.
+    """
+    def __init__(self, config, app_root, middleware):
+        app_config = config.get('application')
+        log_config = config.get('logging')
+        mysql_config = config.get('mysql')
+
+        self._set('debug', log_config.getboolean('debug'))
+
+        if mysql_config.get('database') is not None:
+            mysql_kwargs = mysql_config.dict()
+            if 'replicas' in mysql_kwargs:
+                replicas = []
+                for name in mysql_config.getitems('replicas'):
+                    replica = config.get('mysql:%s' % (name,)).dict()
+                    replica['name'] = name
+                    replicas.append(replica)
+                mysql_kwargs['replicas'] = replicas
+            self._set('mysql', mysql_kwargs)
+        else:
+            self._set('mysql', None)
+
+        # Statements repeated this many times in one request are reported
+        # by the profiler, None when profiling is disabled.
+        if self.mysql is not None and mysql_config.getboolean('profile'):
+            self._set('profile', int(mysql_config.get('profile_repeat', 3)))
+        else:
+            self._set('profile', None)
+
+        if 'redis' in config:
+            def session():
+                return SessionRedis(config, redis=redis(config))
+        else:
+            def session():
+                return SessionFile(config, app_root=app_root)
+        self._set('session', session)
+
+        self._set('static', app_config.get('static', '').rstrip('/'))
+
+        # Response bodies are sent as written unless a chunk size is set.
+        chunk_size = app_config.get('response_chunk_size')
+        if chunk_size is not None:
+            chunk_size = int(chunk_size)
+        self._set('chunk_size', chunk_size)
+
+        self._set('pre', tuple([m.pre for m in middleware
+                                if hasattr(m, 'pre')]))
+        self._set('post', tuple([m.post for m in reversed(middleware)
+                                 if hasattr(m, 'post')]))
+
+    def _set(self, name, value):
+        super(Runtime, self).__setattr__(name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("'runtime' object can't bind" +
+                             " attribute '%s'" % (name,))
+
+
 class Wsgi(object):
     def __init__(self):
         self.running = False
@@ -76,6 +142,27 @@ class Wsgi(object):
             middleware = self.app_config.getitems('middleware')
             self.middleware = self._m_objs(self.modules, middleware)
 
+            route_cache = int(self.app_config.get('route_cache', 0))
+            self.router.cache(route_cache)
+
+            query_cache = int(self.app_config.get('query_cache', 1024))
+            if ('redis' in self.config and
+                    self.app_config.getboolean('query_cache_redis')):
+                querycache.configure(query_cache, redis(self.config))
+            else:
+                querycache.configure(query_cache)
+
+            self.runtime = Runtime(self.config, self.app_root,
+                                   self.middleware)
+            root.jinja.globals['STATIC'] = self.runtime.static
+
+            sweep_interval = float(self.app_config.get('session_sweep_interval', 0))
+            if 'redis' not in self.config and sweep_interval > 0:
+                session_expire = int(self.app_config.get('session_expire', 3600))
+                self.sweeper = Sweeper("%s/tmp" % (self.app_root,),
+                                       session_expire, sweep_interval)
+                self.sweeper.start()
+
             if os.path.isfile(policy):
                 policy = file(policy, 'r').read()
                 self.policy = json.loads(policy)
@@ -174,10 +261,34 @@ class Wsgi(object):
 
         return resp
 
+    def _profile(self, req, resp=None):
+        # Streamed responses are profiled after the body is sent, when
+        # the headers are gone, so only the log has their profile.
+        mysql.profile_stop()
+        summary = req.profiler.summary()
+        if resp is not None:
+            resp.headers['X-SQL-Profile'] = ("queries=%d; time=%.6f; repeated=%d" %
+                                             (summary['queries'],
+                                              summary['duration'],
+                                              len(summary['repeated'])))
+        log.info("SQL Profile %s %s (QUERIES: %s) (ROWS: %s) (DURATION: %.6f)" %
+                 (req.method, req.get_full_path(), summary['queries'],
+                  summary['rows'], summary['duration']))
+        for repeated in summary['repeated']:
+            log.warning("SQL Repeated %s times %s (DURATION: %.6f) (%s)" %
+                        (repeated['count'], repeated['sql'],
+                         repeated['duration'],
+                         ", ".join(repeated['sites'])))
+
     def _cleanup(self):
         root.jinja.clean_up()
         RestClient().close_all()
         Mysql.close_all()
+        # model can't be imported while the package initialises and has
+        # no per request state unless an application loaded it.
+        model = sys.modules.get('tachyonic.neutrino.model')
+        if model is not None:
+            model.clear()
         self.logger.stdout.flush()
         sys.stdout.flush()
         sys.stderr.flush()
@@ -188,6 +299,16 @@ class Wsgi(object):
         e += " - Please view logs\" }"
         return [ str(e).encode('utf-8') ]
 
+    def _finish(self, session, req):
+        try:
+            if req.profiler is not None:
+                self._profile(req)
+            self._cleanup()
+            session.save()
+        except Exception as e:
+            trace = str(traceback.format_exc())
+            log.error("%s\n%s" % (e, trace))
+
     # The application interface is a callable object
     def _interface(self, environ, start_response):
         # environ points to a dictionary containing CGI like environment
@@ -200,21 +321,22 @@ class Wsgi(object):
         # in the HTTP request body which is passed by the WSGI server
         # in the file like wsgi.input environment variable.
         try:
-            debug = self.log_config.getboolean('debug')
+            runtime = self.runtime
+            debug = runtime.debug
 
-            if 'redis' in self.config:
-                redis = root.neutrino.redis(self.config)
-                session = SessionRedis(self.config, redis=redis)
-            else:
-                session = SessionFile(self.config, app_root=self.app_root)
+            session = runtime.session()
             session_cookie = session.setup(environ)
 
-            mysql_config = self.config.get('mysql')
-            if mysql_config.get('database') is not None:
-                Mysql(**mysql_config.dict())
+            if runtime.mysql is not None:
+                Mysql(**runtime.mysql)
 
             req = Request(environ, self.config, session, root.router, self.logger, self)
-            resp = Response(req)
+            resp = Response(req, chunk_size=runtime.chunk_size)
+
+            if runtime.profile is not None:
+                req.profiler = mysql.profile_start(runtime.profile)
+            else:
+                req.profiler = None
 
             resp.headers['Set-Cookie'] = session_cookie
 
@@ -226,14 +348,11 @@ class Wsgi(object):
 
             response_headers = []
 
-            root.jinja.globals['SITE'] = req.environ['SCRIPT_NAME']
+            site = req.environ['SCRIPT_NAME']
+            if site == '/':
+                site = ''
+            root.jinja.globals['SITE'] = site
             root.jinja.request['REQUEST'] = req
-            if root.jinja.globals['SITE'] == '/':
-                root.jinja.globals['SITE'] = ''
-            root.jinja.globals['STATIC'] = self.app_config.get('static',
-                                                              '').rstrip('/')
-            if root.jinja.globals['STATIC'] == '/':
-                root.jinja.globals['STATIC'] = ''
 
             returned = None
             try:
@@ -248,9 +367,8 @@ class Wsgi(object):
                 policy = Policy(self.policy, context=req.context, session=req.session, kwargs=obj_kwargs, qwargs=req.query)
                 req.policy = policy
 
-                for m in self.middleware:
-                    if hasattr(m, 'pre'):
-                        m.pre(req, resp)
+                for pre in runtime.pre:
+                    pre(req, resp)
 
                 if r is not None:
                     if req.view is None or policy.validate(req.view):
@@ -262,9 +380,8 @@ class Wsgi(object):
                 else:
                     raise exceptions.HTTPNotFound(description=req.environ['PATH_INFO'])
 
-                for m in reversed(self.middleware):
-                    if hasattr(m, 'post'):
-                        m.post(req, resp)
+                for post in runtime.post:
+                    post(req, resp)
 
             except exceptions.HTTPError as e:
                 if debug is True:
@@ -278,6 +395,12 @@ class Wsgi(object):
 
             resp.headers['X-Powered-By'] = 'Neutrino'
             resp.headers['X-Request-ID'] = req.request_id
+
+            streaming = returned is None and resp.streaming
+
+            # Queries of a streamed body run while it is sent, see _finish.
+            if req.profiler is not None and streaming is False:
+                self._profile(req, resp)
             # HTTP headers expected by the client
             # They must be wrapped as a list of tupled pairs:
             # [(Header name, Header value)].
@@ -290,7 +413,8 @@ class Wsgi(object):
             content_length = None
 
             if returned is None:
-                content_length = resp.content_length
+                if streaming is False:
+                    content_length = resp.content_length
             else:
                 if isinstance(returned, str):
                     content_length = len(returned)
@@ -302,13 +426,18 @@ class Wsgi(object):
             # Send status and headers to the server using the supplied function
             start_response(resp.status, response_headers)
 
+            if streaming is True:
+                # The body may still read from the database, so the
+                # cleanup runs when the server closes it.
+                return resp.stream_body(lambda: self._finish(session, req))
+
             self._cleanup()
             session.save()
 
             if returned is not None:
                 return returned
             else:
-                return resp
+                return resp.chunks()
         except Exception as e:
             trace = str(traceback.format_exc())
             log.error("%s\n%s" % (e, trace))
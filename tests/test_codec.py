@@ -0,0 +1,42 @@
+import logging
+import pickle
+import unittest
+from datetime import datetime
+from datetime import date
+
+from tachyonic.neutrino import codec
+from tachyonic.neutrino import exceptions
+
+log = logging.getLogger(__name__)
+
+SESSION = {'user_id': 1234,
+           'username': u'chris',
+           'admin': True,
+           'locked': False,
+           'balance': 12.5,
+           'nothing': None,
+           'roles': [u'admin', u'user'],
+           'tenant': {u'id': 1, u'name': u'acme', u'__t__': u'kept'},
+           'position': (1, 2),
+           'flags': set([1, 2]),
+           'keys': {1: u'one'},
+           'login': datetime(2017, 3, 1, 12, 30, 15, 5000),
+           'birthday': date(1980, 1, 2)}
+
+
+class TestCodec(unittest.TestCase):
+    def test_pickle(self):
+        pickled = codec.get('pickle')
+        self.assertEqual(codec.decode(codec.encode(pickled, SESSION)), SESSION)
+
+    def test_json(self):
+        json = codec.get('json')
+        self.assertEqual(codec.decode(codec.encode(json, SESSION)), SESSION)
+
+    def test_legacy(self):
+        raw = pickle.dumps(SESSION)
+        self.assertEqual(codec.decode(raw, pickle.loads), SESSION)
+        self.assertEqual(codec.decode(b'True'), b'True')
+
+    def test_unknown(self):
+        self.assertRaises(exceptions.Error, codec.get, 'yaml')
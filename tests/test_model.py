@@ -0,0 +1,512 @@
+import json
+import logging
+import unittest
+from datetime import datetime
+
+from tachyonic.neutrino import model
+from tachyonic.neutrino.model import Model
+from tachyonic.neutrino.model import ModelDict
+from tachyonic.neutrino import mysql
+from tachyonic.neutrino import querycache
+
+log = logging.getLogger(__name__)
+
+
+class User(Model):
+    name = Model.Text()
+    email = Model.Email()
+    admin = Model.Bool()
+
+    class Meta:
+        db_table = 'user'
+
+
+class TestBulkInsert(unittest.TestCase):
+    def test_chunks(self):
+        sql = "INSERT INTO user (name,email,admin) VALUES "
+        db = mysql.Testing([{'query': sql + "(%s,%s,%s),(%s,DEFAULT,%s)",
+                       'values': ('a', 'a@example.com', True, 'b', False),
+                       'last_row_count': 2},
+                      {'query': sql + "(%s,%s,%s)",
+                       'values': ('c', 'c@example.com', False),
+                       'last_row_count': 1}])
+        users = User(db=db)
+        count = users.bulk_insert([{'name': 'a', 'email': 'a@example.com',
+                                    'admin': True},
+                                   {'name': 'b', 'admin': False},
+                                   {'name': 'c', 'email': 'c@example.com',
+                                    'admin': False}], chunk_size=2,
+                                   append=True)
+        users.commit()
+        self.assertEqual(count, 3)
+        self.assertEqual(db.execute_count, 2)
+        self.assertEqual(len(users), 3)
+        self.assertEqual(users[1]['name'].value(), 'b')
+
+    def test_update(self):
+        sql = ("INSERT INTO user (name,id) VALUES (%s,%s)" +
+               " ON DUPLICATE KEY UPDATE name=VALUES(name)")
+        db = mysql.Testing([{'query': sql, 'values': ('a', 1),
+                       'last_row_count': 2}])
+        users = User(db=db)
+        users.bulk_insert([{'id': 1, 'name': 'a'}], update=True)
+        users.commit()
+        self.assertEqual(db.execute_count, 1)
+
+    def test_append(self):
+        db = mysql.Testing([{'query': "INSERT INTO user (name) VALUES (%s)",
+                       'values': ('a',)}])
+        users = User(db=db)
+        users.append({'name': 'a'})
+        users.commit()
+        self.assertEqual(db.execute_count, 1)
+
+
+class TestStatements(unittest.TestCase):
+    def test_cached(self):
+        queries = []
+
+        class Db(mysql.Testing):
+            def execute(self, query, values=None):
+                queries.append(query)
+                return []
+
+        db = Db([])
+        users = User(db=db)
+        users.append({'name': 'a'})
+        users.append({'name': 'b'})
+        users.append({'name': 'c', 'email': 'c@example.com'})
+        self.assertEqual(queries[2], "INSERT INTO user (name,email)" +
+                                     " VALUES (%s,%s)")
+        self.assertIs(queries[0], queries[1])
+
+
+class Country(Model):
+    name = Model.Text()
+
+    class Meta:
+        db_table = 'country'
+        cache_ttl = 60
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        querycache.configure(16)
+
+    def test_cached(self):
+        sql = "SELECT name FROM country"
+        db = mysql.Testing([{'query': sql, 'result': [{'name': 'ZA'}]},
+                            {'query': "INSERT INTO country (name)" +
+                                      " VALUES (%s)",
+                             'values': ('NL',)},
+                            {'query': sql, 'result': [{'name': 'ZA'},
+                                                      {'name': 'NL'}]}])
+        countries = Country(db=db)
+        countries.query()
+        countries.query()
+        self.assertEqual(db.execute_count, 1)
+        self.assertEqual(len(countries), 1)
+
+        countries.append({'name': 'NL'})
+        countries.query()
+        countries.commit()
+        self.assertEqual(db.execute_count, 3)
+        self.assertEqual(len(countries), 2)
+        self.assertEqual(querycache.stats()['hits'] >= 1, True)
+
+    def test_uncommitted(self):
+        sql = "SELECT name FROM country"
+        db = mysql.Testing([{'query': "INSERT INTO country (name)" +
+                                      " VALUES (%s)",
+                             'values': ('NL',)},
+                            {'query': sql, 'result': [{'name': 'NL'}]},
+                            {'query': sql, 'result': [{'name': 'NL'}]},
+                            {'query': sql, 'result': []},
+                            {'query': sql, 'result': [{'name': 'ZA'}]}])
+        countries = Country(db=db)
+        countries.append({'name': 'NL'})
+        # Reads after a write in the transaction bypass the cache.
+        countries.query()
+        countries.query()
+        self.assertEqual(db.execute_count, 3)
+        self.assertEqual(len(countries), 1)
+
+        countries.rollback()
+        countries.query()
+        countries.query()
+        self.assertEqual(db.execute_count, 4)
+        self.assertEqual(len(countries), 0)
+
+
+class _Counter(mysql.Testing):
+    """Counts statements, SELECTs by primary key return one row."""
+    def __init__(self):
+        mysql.Testing.__init__(self, [])
+        self.statements = []
+
+    def execute(self, query, values=None):
+        self.statements.append(query)
+        if query.startswith('SELECT'):
+            return [{'id': 1, 'name': 'old', 'email': None, 'phone': None,
+                     'city': None, 'country': None}]
+        self._last_row_id = 2
+        return []
+
+
+class Account(ModelDict):
+    name = ModelDict.Text()
+    email = ModelDict.Email()
+    phone = ModelDict.Text()
+    city = ModelDict.Text()
+    country = ModelDict.Text()
+
+    class Meta:
+        db_table = 'account'
+
+
+class UnitOfWorkAccount(Account):
+    class Meta:
+        db_table = 'account'
+        unit_of_work = True
+
+
+class TestUnitOfWork(unittest.TestCase):
+    FIELDS = {'name': 'new',
+              'email': 'new@example.com',
+              'phone': '555',
+              'city': 'Cape Town',
+              'country': 'ZA'}
+
+    def tearDown(self):
+        model.clear()
+
+    def assign(self, account):
+        account.query()
+        for field in sorted(self.FIELDS):
+            account[field] = self.FIELDS[field]
+        account.commit()
+
+    def test_without(self):
+        db = _Counter()
+        self.assign(Account(id=1, db=db))
+        # Initial load, then a SELECT and UPDATE per assignment.
+        self.assertEqual(len(db.statements), 11)
+
+    def test_coalesced(self):
+        db = _Counter()
+        self.assign(UnitOfWorkAccount(id=1, db=db))
+        self.assertEqual(db.statements,
+                         ["SELECT name, email, phone, city, country, id" +
+                          " FROM account WHERE id = %s",
+                          "UPDATE account SET name=%s,email=%s,phone=%s," +
+                          "city=%s,country=%s WHERE id = %s"])
+
+    def test_identity_map(self):
+        db = _Counter()
+        UnitOfWorkAccount(id=1, db=db).query()
+        UnitOfWorkAccount(id=1, db=db).query()
+        self.assertEqual(len(db.statements), 1)
+        model.clear()
+        UnitOfWorkAccount(id=1, db=db).query()
+        self.assertEqual(len(db.statements), 2)
+
+    def test_bulk_upsert(self):
+        db = _Counter()
+
+        class Accounts(Model):
+            name = Model.Text()
+
+            class Meta:
+                db_table = 'account'
+                unit_of_work = True
+
+        UnitOfWorkAccount(id=1, db=db).query()
+        Accounts(db=db).bulk_insert([{'id': 1, 'name': 'new'}], update=True)
+        UnitOfWorkAccount(id=1, db=db).query()
+        self.assertEqual(len(db.statements), 3)
+        self.assertTrue(db.statements[2].startswith("SELECT"))
+
+    def test_insert(self):
+        db = mysql.Testing([{'query': "INSERT INTO account (name,email)" +
+                                      " VALUES (%s,%s)",
+                             'values': ('a', 'a@example.com'),
+                             'last_row_id': 7}])
+        account = UnitOfWorkAccount(db=db)
+        account['name'] = 'a'
+        account['email'] = 'a@example.com'
+        self.assertEqual(db.execute_count, 0)
+        account.commit()
+        self.assertEqual(account['id'].value(), 7)
+
+    def test_rollback(self):
+        db = _Counter()
+        account = UnitOfWorkAccount(id=1, db=db)
+        account.query()
+        account['name'] = 'new'
+        account.rollback()
+        account.commit()
+        self.assertEqual(len(db.statements), 1)
+
+
+class _People(mysql.Testing):
+    """Person rows each referenced by one address row."""
+    def __init__(self, count):
+        mysql.Testing.__init__(self, [])
+        self.count = count
+        self.statements = []
+
+    def address(self, person):
+        return {'id': 100 + person, 'person': person,
+                'street': 'street %d' % person}
+
+    def execute(self, query, values=None):
+        self.statements.append(query)
+        if 'FROM address WHERE person IN' in query:
+            return [self.address(person) for person in values]
+        elif 'FROM address WHERE person =' in query:
+            return [self.address(values[0])]
+        elif 'FROM address WHERE id =' in query:
+            return [self.address(values[0] - 100)]
+        return [{'id': i, 'name': 'person %d' % i, 'address': i}
+                for i in range(1, self.count + 1)]
+
+
+def _people(db):
+    class Address(ModelDict):
+        person = ModelDict.Integer()
+        street = ModelDict.Text()
+
+        class Meta:
+            db_table = 'address'
+
+    class Person(Model):
+        name = Model.Text()
+        address = Address(db=db, foreign_key='person')
+
+        class Meta:
+            db_table = 'person'
+
+    return Person(db=db)
+
+
+def _streets(db):
+    class Address(ModelDict):
+        street = ModelDict.Text()
+
+        class Meta:
+            db_table = 'address'
+
+    class Person(Model):
+        name = Model.Text()
+        address = Address(db=db, foreign_key='person')
+
+        class Meta:
+            db_table = 'person'
+
+    return Person(db=db)
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_without(self):
+        db = _People(5)
+        people = _people(db)
+        people.query()
+        # Foreign key lookup and select by id for every person.
+        self.assertEqual(len(db.statements), 11)
+        self.assertEqual(people[4]['address']['street'].value(), 'street 5')
+
+    def test_prefetch(self):
+        db = _People(5)
+        people = _people(db)
+        people.query(prefetch=['address'])
+        self.assertEqual(db.statements,
+                         ["SELECT name, address FROM person",
+                          "SELECT person, street, id FROM address" +
+                          " WHERE person IN (%s,%s,%s,%s,%s)"])
+        self.assertEqual(len(people), 5)
+        for i, person in enumerate(people):
+            self.assertEqual(person['address']['street'].value(),
+                             'street %d' % (i + 1,))
+            self.assertEqual(person['address']['id'].value(), 101 + i)
+
+    def test_undeclared_foreign_key(self):
+        db = _People(2)
+        people = _streets(db)
+        people.query(prefetch=['address'])
+        self.assertEqual(db.statements[1],
+                         "SELECT street, id, person FROM address" +
+                         " WHERE person IN (%s,%s)")
+        self.assertEqual(people[1]['address']['street'].value(), 'street 2')
+        self.assertFalse('person' in people[1]['address'].value())
+
+        people = _streets(_People(2))
+        people.query(prefetch=['address'], compact=True)
+        self.assertEqual(people[1]['address']['street'], 'street 2')
+        self.assertEqual(people[1].dump()['address'],
+                         {'street': 'street 2', 'id': 102})
+        self.assertEqual(people[1].edit()['address']['street'].value(),
+                         'street 2')
+
+    def test_bulk_insert(self):
+        db = _People(0)
+        people = _people(db)
+        people.bulk_insert([{'name': 'person %d' % i, 'address': i}
+                            for i in range(1, 4)])
+        # No sub model queries unless the rows are appended.
+        self.assertEqual(db.statements,
+                         ["INSERT INTO person (name,address) VALUES" +
+                          " (%s,%s),(%s,%s),(%s,%s)"])
+        self.assertEqual(len(people), 0)
+
+    def test_not_foreign_key(self):
+        people = _people(_People(1))
+        self.assertRaises(model.exceptions.ValidationError,
+                          people.query, prefetch=['name'])
+
+
+class TestDeclaredFields(unittest.TestCase):
+    def test_shared(self):
+        first = User()
+        second = User(db=mysql.Testing([]))
+        self.assertEqual(list(first._declared_fields),
+                         ['name', 'email', 'admin'])
+        self.assertEqual(list(second._declared_fields),
+                         ['name', 'email', 'admin', 'id'])
+        self.assertTrue(first._declared_fields['name'] is
+                        second._declared_fields['name'])
+        self.assertEqual(first._declared_fields['name']._name, 'name')
+
+    def test_copy(self):
+        field = User()._get_field('email')
+        self.assertTrue(isinstance(field, Model.Email))
+        self.assertFalse(field is User()._declared_fields['email'])
+        self.assertEqual(field._name, 'email')
+
+
+class TestCompact(unittest.TestCase):
+    def test_rows(self):
+        db = mysql.Testing([{'query': "SELECT name, email, admin FROM user",
+                             'result': [{'id': 1, 'name': 'a',
+                                         'email': 'a@example.com',
+                                         'admin': True},
+                                        {'id': 2, 'name': 'b',
+                                         'email': None, 'admin': False}]}])
+        users = User(db=db)
+        users.query(compact=True)
+        self.assertEqual(len(users), 2)
+        self.assertTrue(isinstance(users[0], model.Row))
+        self.assertTrue(users[0]._columns is users[1]._columns)
+        self.assertEqual(users[0]['name'], 'a')
+        self.assertEqual(users[1].get('email'), None)
+        self.assertEqual(list(users[1].value().items()),
+                         [('name', 'b'), ('email', None), ('admin', False),
+                          ('id', 2)])
+        self.assertEqual(json.loads(users.dump_json())[0]['email'],
+                         'a@example.com')
+        self.assertRaises(model.exceptions.ValidationError,
+                          users[0].__setitem__, 'name', 'c')
+
+    def test_db_values(self):
+        # Booleans come back from the database as integers.
+        rows = [{'id': 1, 'name': 'a', 'email': None, 'admin': 1},
+                {'id': 2, 'name': 'b', 'email': None, 'admin': 0}]
+        query = "SELECT name, email, admin FROM user"
+        users = User(db=mysql.Testing([{'query': query, 'result': rows}]))
+        users.query(compact=True)
+        self.assertTrue(users[0]['admin'] is True)
+        self.assertTrue(users[1]['admin'] is False)
+        compact = users.dump_json()
+        users = User(db=mysql.Testing([{'query': query, 'result': rows}]))
+        users.query()
+        self.assertEqual(json.loads(compact), json.loads(users.dump_json()))
+        self.assertEqual(json.loads(compact)[0]['admin'], True)
+
+    def test_phone(self):
+        class Contact(Model):
+            phone = Model.Phone()
+
+            class Meta:
+                db_table = 'contact'
+
+        db = mysql.Testing([{'query': "SELECT phone FROM contact",
+                             'result': [{'id': 1, 'phone': '+27 21 555'},
+                                        {'id': 2, 'phone': None}]}])
+        contacts = Contact(db=db)
+        contacts.query(compact=True)
+        self.assertEqual(contacts[0]['phone'], '+2721555')
+        self.assertEqual(contacts[1]['phone'], None)
+
+    def test_edit(self):
+        db = mysql.Testing([{'query': "SELECT name, email, admin FROM user",
+                             'result': [{'id': 1, 'name': 'a',
+                                         'email': None, 'admin': True}]},
+                            {'query': "SELECT name, email, admin, id" +
+                                      " FROM user WHERE id = %s",
+                             'values': (1,),
+                             'result': [{'id': 1, 'name': 'a',
+                                         'email': None, 'admin': True}]},
+                            {'query': "UPDATE user SET name=%s" +
+                                      " WHERE id = %s",
+                             'values': ('b', 1)}])
+        users = User(db=db)
+        users.query(compact=True)
+        user = users[0].edit()
+        self.assertEqual(user['name'].value(), 'a')
+        user['name'] = 'b'
+        users.commit()
+
+    def test_prefetch(self):
+        db = _People(3)
+        people = _people(db)
+        people.query(prefetch=['address'], compact=True)
+        self.assertEqual(len(db.statements), 2)
+        self.assertEqual(people[2]['address']['street'], 'street 3')
+        address = people[2]['address'].edit()
+        self.assertEqual(address['street'].value(), 'street 3')
+        self.assertEqual(address._id, 103)
+
+
+class Event(Model):
+    name = Model.Text()
+    when = Model.Datetime()
+    data = Model.JsonObject()
+    secret = Model.Password()
+
+
+class TestJson(unittest.TestCase):
+    def events(self, count):
+        events = Event()
+        for i in range(count):
+            events.append({'name': 'event %d' % i,
+                           'when': datetime(2016, 1, 2, 3, 4, i),
+                           'data': '{"n": %d}' % i,
+                           'secret': '$2b$' + 'x' * 40}, False)
+        return events
+
+    def test_dump(self):
+        events = self.events(2)
+        self.assertEqual(events.dump_json(),
+                         '[{"name": "event 0", "when": "2016/01/02 03:04:00",'
+                         ' "data": {"n": 0}, "secret": null},'
+                         ' {"name": "event 1", "when": "2016/01/02 03:04:01",'
+                         ' "data": {"n": 1}, "secret": null}]')
+        self.assertEqual(events[1].dump()['name'], 'event 1')
+        # Options the writer doesn't support use the generic encoder.
+        self.assertEqual(json.loads(events.dump_json(sort_keys=True)),
+                         json.loads(events.dump_json()))
+
+    def test_iter(self):
+        events = self.events(5)
+        chunks = list(events.iter_json(rows=2, separators=(',', ':')))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks),
+                         events.dump_json(separators=(',', ':')))
+        self.assertEqual(list(Event().iter_json()), ['[]'])
+
+    def test_load(self):
+        events = Event()
+        events.load_json('[{"name": "a"}, {"name": "b"}]')
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[1]['name'].value(), 'b')
+        self.assertRaises(model.exceptions.ValidationError,
+                          events.load_json, '{"name": "a"}')
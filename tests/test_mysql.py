@@ -0,0 +1,543 @@
+import time
+import logging
+import threading
+import unittest
+
+import mock
+from pymysql import OperationalError
+
+from tachyonic.neutrino import exceptions
+from tachyonic.neutrino.logger import Logger
+from tachyonic.neutrino import mysql
+from tachyonic.neutrino import querycache
+from tachyonic.neutrino.mysql import Pool
+from tachyonic.neutrino.mysql import Mysql
+from tachyonic.neutrino.mysql import cursors
+
+log = logging.getLogger(__name__)
+
+
+class _Cursor(object):
+    def __init__(self, conn, cursorclass):
+        self.conn = conn
+        self.cursorclass = cursorclass
+        self.lastrowid = None
+        self.rowcount = 0
+        self.rows = []
+        self.fetches = 0
+        self.closed = False
+
+    def execute(self, query, params=None):
+        if self.conn.fail is True:
+            raise OperationalError(2013, 'Lost connection')
+        if query in self.conn.errors:
+            raise self.conn.errors[query]
+        self.conn.queries.append(query)
+        self.rows = list(self.conn.results.get(query, self.conn.rows))
+
+    def executemany(self, query, params):
+        self.conn.batches.append(params)
+        return len(params)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class _Connection(object):
+    thread_id = 1
+
+    def __init__(self, host=None):
+        self.host = host
+        self.fail = False
+        self.results = {}
+        self.errors = {}
+        self.pings = 0
+        self.closed = False
+        self.queries = []
+        self.rows = []
+        self.batches = []
+        self.cursors = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, cursorclass=None):
+        cursor = _Cursor(self, cursorclass)
+        self.cursors.append(cursor)
+        return cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def get_server_info(self):
+        return 'fake'
+
+    def get_host_info(self):
+        return 'localhost'
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+
+    def close(self):
+        self.closed = True
+
+
+class _Factory(object):
+    def __init__(self):
+        self.connections = []
+
+    def __call__(self, host=None):
+        conn = _Connection(host)
+        self.connections.append(conn)
+        return conn
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        self.factory = _Factory()
+
+    def test_reuse(self):
+        pool = Pool(self.factory, max_size=2)
+        first = pool.get()
+        pool.put(first)
+        second = pool.get()
+        self.assertIs(first, second)
+        self.assertEqual(len(self.factory.connections), 1)
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['created'], 1)
+
+    def test_timeout(self):
+        pool = Pool(self.factory, max_size=1, timeout=0.05)
+        pool.get()
+        self.assertRaises(exceptions.PoolTimeout, pool.get)
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waiters'], 0)
+
+    def test_wait(self):
+        pool = Pool(self.factory, max_size=1, timeout=5)
+        pooled = pool.get()
+
+        def release():
+            time.sleep(0.05)
+            pool.put(pooled)
+
+        t = threading.Thread(target=release)
+        t.start()
+        self.assertIs(pool.get(), pooled)
+        t.join()
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertTrue(stats['wait_time'] > 0)
+        self.assertEqual(len(self.factory.connections), 1)
+
+    def test_discard(self):
+        pool = Pool(self.factory, max_size=1)
+        pooled = pool.get()
+        pool.put(pooled, True)
+        self.assertTrue(pooled.conn.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+        self.assertIsNot(pool.get(), pooled)
+
+    def test_idle_eviction(self):
+        pool = Pool(self.factory, min_size=1, max_size=3, idle_timeout=10)
+        connections = [pool.get() for i in range(3)]
+        for pooled in connections:
+            pool.put(pooled)
+        with mock.patch('time.time', return_value=time.time() + 20):
+            pooled = pool.get()
+            pool.put(pooled)
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['closed'], 2)
+        self.assertEqual(sum(1 for c in self.factory.connections
+                             if c.closed), 2)
+
+    def test_recycle(self):
+        pool = Pool(self.factory, recycle=100, ping_after=1000)
+        pooled = pool.get()
+        pool.put(pooled)
+        with mock.patch('time.time', return_value=time.time() + 200):
+            fresh = pool.get()
+        self.assertIsNot(fresh, pooled)
+        self.assertTrue(pooled.conn.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_ping_after_idle(self):
+        pool = Pool(self.factory, ping_after=60)
+        pooled = pool.get()
+        pool.put(pooled)
+        pool.get()
+        self.assertEqual(pooled.conn.pings, 0)
+        pool.put(pooled)
+        with mock.patch('time.time', return_value=time.time() + 120):
+            pool.get()
+        self.assertEqual(pooled.conn.pings, 1)
+
+    def test_failed_connect(self):
+        def factory():
+            raise IOError('refused')
+
+        pool = Pool(factory, max_size=1, timeout=0.05)
+        self.assertRaises(IOError, pool.get)
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 0)
+        self.assertEqual(stats['in_use'], 0)
+
+
+class TestMysql(unittest.TestCase):
+    def setUp(self):
+        self.factory = _Factory()
+        self.patch = mock.patch('tachyonic.neutrino.mysql.connect',
+                                side_effect=lambda *args: self.factory())
+        self.patch.start()
+        Mysql._pool.pop('lazy', None)
+        Mysql._credentials.pop('lazy', None)
+
+    def tearDown(self):
+        Mysql.close_all()
+        Mysql._pool.pop('lazy', None)
+        Mysql._credentials.pop('lazy', None)
+        self.patch.stop()
+
+    def test_unused(self):
+        db = Mysql('lazy', database='test')
+        db.commit()
+        db.rollback()
+        self.assertEqual(db.last_row_id(), None)
+        Mysql.close_all()
+        self.assertEqual(self.factory.connections, [])
+        self.assertEqual(Mysql.stats()['lazy']['in_use'], 0)
+
+    def test_checkout_on_execute(self):
+        db = Mysql('lazy', database='test')
+        db.execute("SELECT 1")
+        db.execute("SELECT 2")
+        self.assertEqual(len(self.factory.connections), 1)
+        conn = self.factory.connections[0]
+        self.assertEqual(conn.queries, ["SELECT 1", "SELECT 2"])
+        self.assertEqual(Mysql.stats()['lazy']['in_use'], 1)
+
+        Mysql.close_all()
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual(Mysql.stats()['lazy']['in_use'], 0)
+
+        # Handles survive the request and check out again when used.
+        db.execute("SELECT 3")
+        self.assertEqual(len(self.factory.connections), 1)
+        self.assertEqual(conn.queries[-1], "SELECT 3")
+
+    def test_stream(self):
+        db = Mysql('lazy', database='test')
+        rows = db.stream("SELECT id FROM big")
+        self.assertEqual(self.factory.connections, [])
+
+        self.assertEqual(list(rows), [])
+        cursor = self.factory.connections[0].cursors[-1]
+        self.assertIs(cursor.cursorclass, cursors.SSDictCursor)
+
+    def test_stream_batches(self):
+        db = Mysql('lazy', database='test')
+        db.execute("SELECT 1")
+        conn = self.factory.connections[0]
+        conn.rows = [{'id': i} for i in range(5)]
+
+        rows = list(db.stream("SELECT id FROM big", batch_size=2))
+        self.assertEqual(rows, conn.rows)
+        cursor = conn.cursors[-1]
+        self.assertEqual(cursor.fetches, 4)
+        self.assertTrue(cursor.closed)
+
+        conn.rows = [(1,), (2,)]
+        rows = db.stream("SELECT id FROM big", tuples=True)
+        self.assertEqual(next(rows), (1,))
+        rows.close()
+        self.assertIs(conn.cursors[-1].cursorclass, cursors.SSCursor)
+        self.assertTrue(conn.cursors[-1].closed)
+
+    def test_executemany(self):
+        db = Mysql('lazy', database='test')
+        rows = db.executemany("INSERT INTO t VALUES (%s, %s)",
+                              ((i, i % 2 == 0) for i in range(5)),
+                              batch_size=2)
+        conn = self.factory.connections[0]
+        self.assertEqual(rows, 5)
+        self.assertEqual(conn.batches, [[[0, 1], [1, 0]],
+                                        [[2, 1], [3, 0]],
+                                        [[4, 1]]])
+
+    def test_written(self):
+        db = Mysql('lazy', database='test')
+        generation = querycache._generation('t')
+        db.execute("UPDATE t SET a = 1")
+        db.written('t')
+        self.assertTrue(db.writing())
+        self.assertEqual(querycache._generation('t'), generation + 1)
+        db.commit()
+        # Invalidated again when the transaction ends.
+        self.assertFalse(db.writing())
+        self.assertEqual(querycache._generation('t'), generation + 2)
+        db.execute("UPDATE t SET a = 2")
+        db.written('t')
+        db.rollback()
+        self.assertEqual(querycache._generation('t'), generation + 4)
+
+    def test_statements(self):
+        mysql.reset_statements()
+        db = Mysql('lazy', database='test')
+        db.execute("SELECT 1")
+        db.execute("SELECT 1")
+        db.execute("SELECT 2", (True,))
+        stats = mysql.statements()
+        self.assertEqual(stats["SELECT 1"]['count'], 2)
+        self.assertEqual(stats["SELECT 2"]['count'], 1)
+        self.assertTrue(stats["SELECT 1"]['max'] >= 0)
+        mysql.reset_statements()
+        self.assertEqual(mysql.statements(), {})
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.conn = _Connection()
+        self.threshold = mysql.SLOW_QUERY
+
+    def tearDown(self):
+        mysql.slow_query(self.threshold)
+
+    def logger(self, debug):
+        root = logging.getLogger()
+        level = root.level
+        handlers = [(handler, list(handler.filters))
+                    for handler in root.handlers]
+
+        def restore():
+            root.setLevel(level)
+            root.handlers = [handler for handler, filters in handlers]
+            for handler, filters in handlers:
+                handler.filters = filters
+        self.addCleanup(restore)
+        Logger('test', None, None, debug)
+
+    def test_lazy(self):
+        self.logger(False)
+        self.assertFalse(mysql.log.isEnabledFor(logging.DEBUG))
+        with mock.patch('tachyonic.neutrino.mysql._log_query') as fmt:
+            with mock.patch.object(mysql.log, 'debug') as debug:
+                mysql.execute(self.conn.cursor(), "SELECT %s", (1,))
+                mysql.commit(self.conn)
+        self.assertFalse(fmt.called)
+        self.assertFalse(debug.called)
+
+    def test_debug(self):
+        self.logger(True)
+        self.assertTrue(mysql.log.isEnabledFor(logging.DEBUG))
+
+    def test_slow(self):
+        mysql.slow_query(0.5)
+        with mock.patch('tachyonic.neutrino.mysql.clock',
+                        side_effect=[10.0, 11.0]):
+            with mock.patch.object(mysql.slow_log, 'warning') as warning:
+                mysql.execute(self.conn.cursor(), "SELECT %s", (True,))
+        args, kwargs = warning.call_args
+        self.assertEqual(str(args[2]), "SELECT 1")
+        self.assertEqual(kwargs['extra']['sql'], "SELECT %s")
+        self.assertEqual(kwargs['extra']['duration'], 1.0)
+
+        mysql.slow_query(0)
+        with mock.patch('tachyonic.neutrino.mysql.clock',
+                        side_effect=[10.0, 11.0]):
+            with mock.patch.object(mysql.slow_log, 'warning') as warning:
+                mysql.execute(self.conn.cursor(), "SELECT 1")
+        self.assertFalse(warning.called)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.conn = _Connection()
+
+    def tearDown(self):
+        mysql.profile_stop()
+
+    def test_disabled(self):
+        mysql.execute(self.conn.cursor(), "SELECT 1")
+        self.assertEqual(mysql.profile_stop(), None)
+
+    def test_repeated(self):
+        profiler = mysql.profile_start(repeat=3)
+        self.conn.rows = [{'id': 1}]
+        for i in range(3):
+            mysql.execute(self.conn.cursor(),
+                          "SELECT * FROM user WHERE id = %d" % (i,))
+        mysql.execute(self.conn.cursor(), "SELECT * FROM tenant")
+        self.assertIs(mysql.profile_stop(), profiler)
+
+        summary = profiler.summary()
+        self.assertEqual(summary['queries'], 4)
+        self.assertEqual(summary['rows'], 4)
+        self.assertEqual(len(summary['repeated']), 1)
+        repeated = summary['repeated'][0]
+        self.assertEqual(repeated['sql'], "SELECT * FROM user WHERE id = ?")
+        self.assertEqual(repeated['count'], 3)
+        self.assertEqual(len(repeated['sites']), 1)
+        self.assertTrue(repeated['sites'][0].startswith(__file__.rstrip('c')))
+
+        mysql.execute(self.conn.cursor(), "SELECT 1")
+        self.assertEqual(len(profiler.statements), 4)
+
+
+class TestReplicas(unittest.TestCase):
+    def setUp(self):
+        self.factory = _Factory()
+        self.down = set()
+        self.patch = mock.patch('tachyonic.neutrino.mysql.connect',
+                                side_effect=self.connect)
+        self.patch.start()
+        self.reset()
+
+    def connect(self, host, *args):
+        if host in self.down:
+            raise OperationalError(2003, "Can't connect")
+        return self.factory(host)
+
+    def tearDown(self):
+        Mysql.close_all()
+        self.reset()
+        self.patch.stop()
+
+    def reset(self):
+        for name in list(Mysql._pool):
+            if name.startswith('replicated'):
+                del Mysql._pool[name]
+                del Mysql._credentials[name]
+        Mysql._replicas.pop('replicated', None)
+
+    def db(self, **kwargs):
+        return Mysql('replicated', host='primary', database='test',
+                     replicas=[{'name': 'r1', 'host': 'replica1'},
+                               {'name': 'r2', 'host': 'replica2'}],
+                     **kwargs)
+
+    def hosts(self):
+        return [(c.host, c.queries) for c in self.factory.connections]
+
+    def test_round_robin(self):
+        db = self.db()
+        db.execute("SELECT 1")
+        db.execute("SELECT 2")
+        Mysql.close_all()
+        db.execute("SELECT 3")
+        self.assertEqual(self.hosts(), [('replica1', ["SELECT 1", "SELECT 2"]),
+                                        ('replica2', ["SELECT 3"])])
+
+    def test_sticky(self):
+        db = self.db()
+        db.execute("SELECT 1")
+        db.execute("UPDATE t SET a = 1")
+        db.execute("SELECT 2")
+        db.execute("SELECT * FROM t FOR UPDATE")
+        self.assertEqual(self.hosts(),
+                         [('replica1', ["SELECT 1"]),
+                          ('primary', ["UPDATE t SET a = 1", "SELECT 2",
+                                       "SELECT * FROM t FOR UPDATE"])])
+
+        # Stickiness ends with the request.
+        Mysql.close_all()
+        db.execute("SELECT 3")
+        self.assertEqual(self.factory.connections[-1].host, 'replica2')
+
+    def test_least_connections(self):
+        db = self.db(replica_policy='least_connections')
+        busy = Mysql._pool['replicated:r1'].get()
+        db.execute("SELECT 1")
+        Mysql._pool['replicated:r1'].put(busy)
+        self.assertEqual(self.factory.connections[-1].host, 'replica2')
+
+    def test_failure(self):
+        db = self.db()
+        Mysql('replicated:r1').execute("SELECT 0")
+        self.factory.connections[0].fail = True
+        self.down.add('replica1')
+        Mysql.close_all()
+
+        self.assertEqual(db.execute("SELECT 1"), [])
+        self.assertEqual(self.factory.connections[-1].host, 'replica2')
+        self.assertEqual(Mysql._replicas['replicated'].healthy(),
+                         ['replicated:r2'])
+
+    def test_query_error(self):
+        db = self.db()
+        db.execute("SELECT 0")
+        replica1 = self.factory.connections[0]
+        replica1.errors["SELECT nosuch FROM t"] = OperationalError(
+            1054, "Unknown column 'nosuch'")
+
+        self.assertRaises(OperationalError, db.execute, "SELECT nosuch FROM t")
+        # Not retried on the primary and the replica stays in use.
+        self.assertEqual(self.hosts(), [('replica1', ["SELECT 0"])])
+        self.assertEqual(Mysql._replicas['replicated'].healthy(),
+                         ['replicated:r1', 'replicated:r2'])
+        self.assertFalse(replica1.closed)
+
+    def test_lag_denied(self):
+        denied = OperationalError(1227, "Access denied")
+
+        def connect(host, *args):
+            conn = self.factory(host)
+            conn.errors["SHOW SLAVE STATUS"] = denied
+            return conn
+
+        self.patch.stop()
+        self.patch = mock.patch('tachyonic.neutrino.mysql.connect',
+                                side_effect=connect)
+        self.patch.start()
+        db = self.db(replica_max_lag=10, replica_check_interval=0)
+        with mock.patch.object(mysql.log, 'error') as error:
+            db.execute("SELECT 1")
+            Mysql.close_all()
+            db.execute("SELECT 2")
+            Mysql.close_all()
+            db.execute("SELECT 3")
+        # Logged once per replica, not on every check.
+        self.assertEqual(error.call_count, 2)
+        self.assertEqual([(host, queries[-1]) for host, queries
+                          in self.hosts()],
+                         [('replica1', "SELECT 3"), ('replica2', "SELECT 2")])
+        self.assertEqual(Mysql._replicas['replicated'].healthy(),
+                         ['replicated:r1', 'replicated:r2'])
+
+    def test_lag(self):
+        db = self.db(replica_max_lag=10)
+        replicas = Mysql._replicas['replicated']
+        db.execute("SELECT 1")
+        replica1 = self.factory.connections[0]
+        self.assertEqual(replica1.queries, ["SHOW SLAVE STATUS", "SELECT 1"])
+        Mysql.close_all()
+
+        # Replica two is behind, replica one was checked recently.
+        Mysql('replicated:r2').execute("SELECT 0")
+        self.factory.connections[-1].results = {
+            "SHOW SLAVE STATUS": [{'Seconds_Behind_Master': 60}]}
+        Mysql.close_all()
+        db.execute("SELECT 2")
+        self.assertEqual(replicas.healthy(), ['replicated:r1'])
+        self.assertEqual(replica1.queries[-1], "SELECT 2")
+
+        # Without healthy replicas reads go to the primary.
+        replicas.eject('replicated:r1', 'test')
+        Mysql.close_all()
+        db.execute("SELECT 3")
+        self.assertEqual(self.factory.connections[-1].host, 'primary')
@@ -0,0 +1,89 @@
+import time
+import logging
+import unittest
+
+import mock
+
+from tachyonic.neutrino import querycache
+
+log = logging.getLogger(__name__)
+
+
+class _Redis(object):
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        querycache.configure(16)
+
+    def tearDown(self):
+        querycache.configure()
+
+    def test_hit(self):
+        key = querycache.key('user', "SELECT 1", [1])
+        self.assertEqual(querycache.get(key), None)
+        querycache.put(key, [{'id': 1}], 60)
+        self.assertEqual(querycache.get(querycache.key('user', "SELECT 1",
+                                                       (1,))),
+                         [{'id': 1}])
+        self.assertEqual(querycache.get(querycache.key('user', "SELECT 1",
+                                                       (2,))),
+                         None)
+        stats = querycache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_ttl(self):
+        key = querycache.key('user', "SELECT 1")
+        querycache.put(key, [], 60)
+        self.assertEqual(querycache.get(key), [])
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(querycache.get(key), None)
+
+    def test_invalidate(self):
+        querycache.put(querycache.key('user', "SELECT 1"), [], 60)
+        querycache.put(querycache.key('tenant', "SELECT 2"), [], 60)
+        querycache.invalidate('user')
+        self.assertEqual(querycache.get(querycache.key('user', "SELECT 1")),
+                         None)
+        self.assertEqual(querycache.get(querycache.key('tenant', "SELECT 2")),
+                         [])
+
+    def test_invalidate_during_read(self):
+        # A write lands while the result is being read from the database.
+        key = querycache.key('user', "SELECT 1")
+        self.assertEqual(querycache.get(key), None)
+        querycache.invalidate('user')
+        querycache.put(key, [{'id': 1}], 60)
+        self.assertEqual(querycache.get(querycache.key('user', "SELECT 1")),
+                         None)
+
+    def test_redis(self):
+        redis = _Redis()
+        querycache.configure(16, redis)
+        querycache.put(querycache.key('user', "SELECT 1", (1,)),
+                       [{'id': 1}], 60)
+        self.assertEqual(list(redis.ttls.values()), [60])
+        self.assertEqual(querycache.get(querycache.key('user', "SELECT 1",
+                                                       (1,))),
+                         [{'id': 1}])
+        querycache.invalidate('user')
+        self.assertEqual(querycache.get(querycache.key('user', "SELECT 1",
+                                                       (1,))),
+                         None)
+        self.assertTrue(querycache.stats()['redis'])
@@ -0,0 +1,100 @@
+import os
+import logging
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from tachyonic.neutrino import redissy
+from tachyonic.neutrino.config import Config
+
+log = logging.getLogger(__name__)
+
+SETTINGS = """[redis]
+server = localhost
+port = 6379
+max_connections = 4
+socket_timeout = 2.5
+"""
+
+
+class _Connection(object):
+    def __init__(self, **kwargs):
+        self.pid = os.getpid()
+
+    def connect(self):
+        pass
+
+    def can_read(self):
+        return False
+
+    def disconnect(self):
+        pass
+
+
+class TestRedis(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.write(handle, SETTINGS.encode('utf-8'))
+        os.close(handle)
+        self.config = Config(self.path)
+        redissy._client = None
+        redissy._pid = None
+
+    def tearDown(self):
+        os.remove(self.path)
+        redissy._client = None
+        redissy._pid = None
+
+    def test_shared(self):
+        self.assertIsNone(redissy.stats())
+        client = redissy.redis(self.config)
+        self.assertIs(redissy.redis(self.config), client)
+        pool = client.connection_pool
+        self.assertEqual(pool.max_connections, 4)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 2.5)
+
+    def test_exported(self):
+        import tachyonic.neutrino
+        self.assertIs(tachyonic.neutrino.redis, redissy.redis)
+
+    def test_fork(self):
+        client = redissy.redis(self.config)
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNone(redissy.stats())
+            self.assertIsNot(redissy.redis(self.config), client)
+
+    def test_blocking(self):
+        pool = redissy.redis(self.config).connection_pool
+        self.assertTrue(isinstance(pool, redissy.BlockingConnectionPool))
+        self.assertEqual(pool.timeout, 20)
+        pool.connection_class = _Connection
+        pool.timeout = 5
+        held = [pool.get_connection('GET') for i in range(4)]
+        release = threading.Timer(0.05, pool.release, (held[0],))
+        release.start()
+        # Waits for a connection instead of raising too many connections.
+        self.assertIs(pool.get_connection('GET'), held[0])
+        release.join()
+
+    def test_unbounded(self):
+        handle, path = tempfile.mkstemp()
+        os.write(handle, b"[redis]\nserver = localhost\n")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        pool = redissy.redis(Config(path)).connection_pool
+        self.assertTrue(isinstance(pool, redissy.ConnectionPool))
+
+    def test_stats(self):
+        pool = redissy.redis(self.config).connection_pool
+        pool.connection_class = _Connection
+        for i in range(3):
+            conn = pool.get_connection('GET')
+            pool.release(conn)
+        stats = redissy.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['checkouts'], 3)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['in_use'], 0)
@@ -0,0 +1,105 @@
+import json
+import logging
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+from tachyonic.neutrino.model import Model
+from tachyonic.neutrino.response import Response
+from tachyonic.neutrino import constants as const
+
+log = logging.getLogger(__name__)
+
+
+class User(Model):
+    name = Model.Text()
+    score = Model.Integer()
+
+
+class TestStream(unittest.TestCase):
+    def test_rows(self):
+        fetched = []
+
+        def rows():
+            for i in range(5):
+                fetched.append(i)
+                yield {'id': i, 'score': Decimal('1.5'),
+                       'created': datetime(2016, 1, 2, 3, 4, 5)}
+
+        resp = Response()
+        resp.stream_json(rows(), size=2)
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp.headers['Content-Type'],
+                         const.APPLICATION_JSON)
+        body = iter(resp.stream_body())
+        self.assertEqual(json.loads(next(body) + ']'),
+                         [{'id': 0, 'score': 1.5,
+                           'created': '2016/01/02 03:04:05'},
+                          {'id': 1, 'score': 1.5,
+                           'created': '2016/01/02 03:04:05'}])
+        # Rows are fetched as the body is sent.
+        self.assertEqual(fetched, [0, 1])
+        rest = ''.join(body)
+        self.assertEqual(len(json.loads('[' + rest.lstrip(', '))), 3)
+
+    def test_model(self):
+        users = User()
+        for i in range(3):
+            users.append({'name': 'user %d' % i, 'score': i})
+        resp = Response()
+        resp.stream_json(users, size=2)
+        body = b''.join(resp.stream_body())
+        self.assertEqual(body, users.dump_json().encode('utf-8'))
+
+    def test_close(self):
+        closed = []
+
+        def rows():
+            try:
+                yield {'id': 1}
+                yield {'id': 2}
+            finally:
+                closed.append('rows')
+
+        resp = Response()
+        resp.stream_json(rows(), size=1)
+        body = resp.stream_body(lambda: closed.append('cleanup'))
+        next(iter(body))
+        body.close()
+        self.assertEqual(closed, ['rows', 'cleanup'])
+
+    def test_clear(self):
+        resp = Response()
+        resp.stream(iter([b'a']))
+        resp.clear()
+        self.assertFalse(resp.streaming)
+        resp.write('body')
+        self.assertEqual(resp.content_length, 4)
+
+
+class TestBody(unittest.TestCase):
+    def test_chunks(self):
+        resp = Response()
+        resp.write('abc')
+        resp.write(u'd\xe9')
+        self.assertEqual(resp.content_length, 6)
+        self.assertEqual(resp.chunks(), [b'abc', b'd\xc3\xa9'])
+        self.assertEqual(b''.join(resp), b'abcd\xc3\xa9')
+
+    def test_read(self):
+        resp = Response()
+        resp.body = 'line 1\nline 2\n'
+        self.assertEqual(resp.readline(), b'line 1\n')
+        self.assertEqual(resp.read(), b'line 2\n')
+        resp.seek(0)
+        self.assertEqual(resp.read(4), b'line')
+        resp.write('more')
+        self.assertEqual(resp.read(), b'line 1\nline 2\nmore')
+
+    def test_chunk_size(self):
+        resp = Response(chunk_size=4)
+        for data in ('a', 'bc', 'def', '', 'ghijklmnop', 'q'):
+            resp.write(data)
+        self.assertEqual(list(resp.chunks()),
+                         [b'abcdef', b'ghij', b'klmn', b'op', b'q'])
+        self.assertEqual(resp.content_length, 17)
@@ -0,0 +1,152 @@
+import logging
+import unittest
+
+from tachyonic.neutrino import exceptions
+from tachyonic.neutrino.router import Router
+
+log = logging.getLogger(__name__)
+
+
+def _view(req, resp, **kwargs):
+    pass
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router()
+
+    def match(self, method, uri):
+        r = self.router._match(method, uri)
+        if r is None:
+            return None
+        route, kwargs = r
+        return route[3], kwargs
+
+    def test_static(self):
+        self.router.add('GET', '/', _view, 'root')
+        self.router.add('GET', '/users', _view, 'users')
+        self.router.add('GET', '/users/list', _view, 'list')
+        self.assertEqual(self.match('GET', ''), ('root', {}))
+        self.assertEqual(self.match('GET', 'users'), ('users', {}))
+        self.assertEqual(self.match('GET', 'users/list'), ('list', {}))
+        self.assertIsNone(self.match('GET', 'users/list/more'))
+        self.assertIsNone(self.match('GET', 'groups'))
+
+    def test_params(self):
+        self.router.add('GET', '/users/{id}', _view, 'user')
+        self.router.add('GET', '/users/{id}/groups/{group}', _view, 'group')
+        self.assertEqual(self.match('GET', 'users/1'), ('user', {'id': '1'}))
+        self.assertEqual(self.match('GET', 'users/1/groups/admin'),
+                         ('group', {'id': '1', 'group': 'admin'}))
+        self.assertIsNone(self.match('GET', 'users/1/groups'))
+
+    def test_query_string(self):
+        self.router.add('GET', '/users/{id}', _view, 'user')
+        self.assertEqual(self.match('GET', 'users/1?a=b'), ('user', {'id': '1'}))
+
+    def test_wildcard(self):
+        self.router.add('GET', '/static/*', _view, 'static')
+        self.assertEqual(self.match('GET', 'static'), ('static', {}))
+        self.assertEqual(self.match('GET', 'static/css/site.css'), ('static', {}))
+        self.assertIsNone(self.match('GET', 'other/static/site.css'))
+        self.assertRaises(ValueError, self.router.add, 'GET', '/a/*/b', _view)
+
+    def test_backtracking(self):
+        self.router.add('GET', '/users/admin', _view, 'admin')
+        self.router.add('GET', '/users/{id}/edit', _view, 'edit')
+        self.assertEqual(self.match('GET', 'users/admin/edit'),
+                         ('edit', {'id': 'admin'}))
+        self.assertEqual(self.match('GET', 'users/admin'), ('admin', {}))
+
+    def test_method(self):
+        self.router.add('GET', '/users', _view, 'get')
+        self.router.add('POST', '/users', _view, 'post')
+        self.assertEqual(self.match('GET', 'users'), ('get', {}))
+        self.assertEqual(self.match('POST', 'users'), ('post', {}))
+        self.assertIsNone(self.match('DELETE', 'users'))
+
+    def test_duplicate(self):
+        self.router.add('GET', '/users/{id}', _view)
+        self.assertRaises(exceptions.Error, self.router.add,
+                          'GET', '/users/{id}/', _view)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.router.add, 'GET', '/a b', _view)
+        self.assertRaises(ValueError, self.router.add, 'GET', '/{class}', _view)
+
+
+class _Request(object):
+    def __init__(self, method, path):
+        self.method = method
+        self.environ = {'PATH_INFO': path}
+
+
+class TestRouterCache(unittest.TestCase):
+    def setUp(self):
+        self.router = Router(cache_size=2)
+        self.router.add('GET', '/users/{id}', _view, 'user')
+        self.router.add('GET', '/groups', _view, 'groups')
+
+    def test_hits(self):
+        route, kwargs = self.router.route(_Request('GET', '/users/1'))
+        self.assertEqual(kwargs, {'id': '1'})
+        kwargs['id'] = 'changed'
+        route, kwargs = self.router.route(_Request('GET', '/users/1'))
+        self.assertEqual(kwargs, {'id': '1'})
+        info = self.router.cache_info()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 1)
+
+    def test_evictions(self):
+        for path in ('/users/1', '/users/2', '/groups', '/users/1'):
+            self.router.route(_Request('GET', path))
+        info = self.router.cache_info()
+        self.assertEqual(info['entries'], 2)
+        self.assertEqual(info['evictions'], 2)
+
+    def test_not_found(self):
+        self.assertIsNone(self.router.route(_Request('GET', '/missing')))
+        self.assertEqual(self.router.cache_info()['entries'], 0)
+
+    def test_invalidated_by_add(self):
+        self.router.route(_Request('GET', '/users/1'))
+        self.router.add('GET', '/users/{id}/groups', _view, 'user_groups')
+        self.assertEqual(self.router.cache_info()['entries'], 0)
+
+    def test_disabled(self):
+        self.router.cache(0)
+        self.assertIsNone(self.router.cache_info())
+        route, kwargs = self.router.route(_Request('GET', '/users/1'))
+        self.assertEqual(route[3], 'user')
+
+
+class TestRouterAddMany(unittest.TestCase):
+    def setUp(self):
+        self.router = Router()
+
+    def test_add_many(self):
+        self.router.add_many([('GET', '/users', _view),
+                              ('GET', '/users/{id}', _view, 'user')])
+        self.assertEqual(len(self.router.routes), 2)
+        route, kwargs = self.router._match('GET', 'users/1')
+        self.assertEqual(route[3], 'user')
+
+    def test_duplicate_params_collapsed(self):
+        self.router.add('GET', '/users/{id}', _view)
+        self.assertRaises(exceptions.Error, self.router.add,
+                          'GET', '/users/{name}', _view)
+        self.router.add('POST', '/users/{name}', _view)
+
+    def test_static_beside_param(self):
+        self.router.add('GET', '/users/{id}', _view, 'user')
+        self.router.add('GET', '/users/admin', _view, 'admin')
+        self.assertEqual(self.router._match('GET', 'users/admin')[0][3], 'admin')
+        self.assertEqual(self.router._match('GET', 'users/1')[0][3], 'user')
+
+    def test_atomic(self):
+        self.assertRaises(exceptions.Error, self.router.add_many,
+                          [('GET', '/users', _view),
+                           ('GET', '/users/', _view)])
+        self.assertEqual(self.router.routes, [])
+        self.assertIsNone(self.router._match('GET', 'users'))
+        self.router.add('GET', '/users', _view)
@@ -0,0 +1,218 @@
+import os
+import logging
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+from tachyonic.neutrino import codec
+from tachyonic.neutrino.config import Config
+from tachyonic.neutrino.session import SessionRedis
+from tachyonic.neutrino.session import SessionFile
+from tachyonic.neutrino.session import sweep
+
+log = logging.getLogger(__name__)
+
+SETTINGS = """[application]
+session_expire = 3600
+session_refresh = 60
+"""
+
+pickled = codec.get('pickle')
+
+ENVIRON = {'SERVER_NAME': 'localhost',
+           'HTTP_COOKIE': 'tachyonic=abcdefghijklmnop'}
+
+
+class _Pipeline(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name,) + args)
+        return command
+
+    def execute(self):
+        self.redis.round_trips += 1
+        self.redis.executed.append(self.commands)
+        return [getattr(self.redis, command[0])(*command[1:])
+                for command in self.commands]
+
+
+class _Redis(object):
+    def __init__(self, data=None, ttl=3600):
+        self.data = data or {}
+        self.ttls = {}
+        for name in self.data:
+            self.ttls[name] = ttl
+        self.executed = []
+        self.round_trips = 0
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def ttl(self, name):
+        return self.ttls.get(name, -2)
+
+    def hmset(self, name, mapping):
+        self.data.setdefault(name, {}).update(mapping)
+
+    def hdel(self, name, *keys):
+        for key in keys:
+            self.data.get(name, {}).pop(key, None)
+
+    def expire(self, name, expire):
+        if name in self.data:
+            self.ttls[name] = expire
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.write(handle, SETTINGS.encode('utf-8'))
+        os.close(handle)
+        self.config = Config(self.path)
+        self.name = 'session:abcdefghijklmnop'
+        self.redis = _Redis({self.name: {'user': 'chris',
+                                         'admin': 'True'}})
+        self.app_root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.app_root, 'tmp'))
+
+    def tearDown(self):
+        os.remove(self.path)
+        shutil.rmtree(self.app_root)
+
+    def session(self, cls=SessionRedis):
+        session = cls(self.config, redis=self.redis, app_root=self.app_root)
+        session.setup(dict(ENVIRON))
+        return session
+
+    def test_single_load(self):
+        session = self.session()
+        self.assertEqual(self.redis.round_trips, 0)
+        self.assertEqual(session['user'], 'chris')
+        self.assertIs(session['admin'], True)
+        self.assertIsNone(session['missing'])
+        self.assertEqual(session.get('missing', 1), 1)
+        self.assertTrue('user' in session)
+        self.assertEqual(len(session), 2)
+        self.assertEqual(self.redis.round_trips, 1)
+
+    def test_pipelined_save(self):
+        session = self.session()
+        session['a'] = 1
+        session['b'] = 2
+        del session['admin']
+        self.assertEqual(self.redis.round_trips, 0)
+        self.assertEqual(sorted(session), ['a', 'b', 'user'])
+        session.save()
+        self.assertEqual(len(self.redis.executed), 2)
+        self.assertEqual(self.redis.executed[1],
+                         [('hmset', self.name, {'a': codec.encode(pickled, 1),
+                                                'b': codec.encode(pickled, 2)}),
+                          ('hdel', self.name, 'admin'),
+                          ('expire', self.name, 3600)])
+        self.assertEqual(session.round_trips, 2)
+
+    def test_redis_untouched(self):
+        session = self.session()
+        session.save()
+        self.assertEqual(self.redis.round_trips, 0)
+        self.assertEqual(session.round_trips, 0)
+
+    def test_redis_refresh(self):
+        session = self.session()
+        session.get('user')
+        session.save()
+        self.assertEqual(self.redis.round_trips, 1)
+
+        self.redis.ttls[self.name] = 3000
+        session = self.session()
+        session.get('user')
+        session.save()
+        self.assertEqual(self.redis.round_trips, 2)
+        self.assertEqual(self.redis.ttls[self.name], 3600)
+        self.assertEqual(session.round_trips, 2)
+
+    def test_file(self):
+        session = self.session(SessionFile)
+        self.assertIsNone(session.get('user'))
+        session.save()
+        self.assertEqual(os.listdir(os.path.join(self.app_root, 'tmp')), [])
+
+        session = self.session(SessionFile)
+        session['user'] = 'chris'
+        session.save()
+        session = self.session(SessionFile)
+        self.assertEqual(session['user'], 'chris')
+
+    def test_file_unchanged(self):
+        session = self.session(SessionFile)
+        session['user'] = 'chris'
+        session.save()
+        path = session._file()
+        os.utime(path, (time.time() - 30, time.time() - 30))
+        mtime = os.stat(path).st_mtime
+
+        session = self.session(SessionFile)
+        self.assertEqual(session['user'], 'chris')
+        session.save()
+        self.assertEqual(os.stat(path).st_mtime, mtime)
+
+        os.utime(path, (time.time() - 90, time.time() - 90))
+        session = self.session(SessionFile)
+        self.assertEqual(session['user'], 'chris')
+        session.save()
+        self.assertTrue(os.stat(path).st_mtime > mtime)
+
+    def test_file_sharded(self):
+        session = self.session(SessionFile)
+        session['user'] = 'chris'
+        session.save()
+        tmp = os.path.join(self.app_root, 'tmp')
+        self.assertEqual(os.listdir(tmp), ['sessions'])
+        shard = os.listdir(os.path.join(tmp, 'sessions'))
+        self.assertEqual(len(shard), 1)
+        self.assertEqual(os.listdir(os.path.join(tmp, 'sessions', shard[0])),
+                         ['abcdefghijklmnop.session'])
+
+    def test_file_legacy(self):
+        legacy = os.path.join(self.app_root, 'tmp', 'abcdefghijklmnop.session')
+        with open(legacy, 'wb') as h:
+            pickle.dump({'user': 'chris'}, h)
+        session = self.session(SessionFile)
+        self.assertEqual(session['user'], 'chris')
+        session.save()
+        self.assertFalse(os.path.exists(legacy))
+        session = self.session(SessionFile)
+        self.assertEqual(session['user'], 'chris')
+
+    def test_sweep(self):
+        tmp = os.path.join(self.app_root, 'tmp')
+        session = self.session(SessionFile)
+        session['user'] = 'chris'
+        session.save()
+        legacy = os.path.join(tmp, 'legacy.session')
+        with open(legacy, 'wb') as h:
+            pickle.dump({}, h)
+        self.assertEqual(sweep(tmp, 3600), 0)
+        os.utime(session._file(), (time.time() - 7200, time.time() - 7200))
+        os.utime(legacy, (time.time() - 7200, time.time() - 7200))
+        self.assertEqual(sweep(tmp, 3600), 2)
+        self.assertFalse(os.path.exists(session._file()))
+
+    def test_redis_codec(self):
+        session = self.session()
+        session['roles'] = ['admin', 'user']
+        session['id'] = 10
+        session.save()
+        session = self.session()
+        self.assertEqual(session['roles'], ['admin', 'user'])
+        self.assertEqual(session['id'], 10)
+        self.assertEqual(session['user'], 'chris')
@@ -0,0 +1,96 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+import mock
+
+from tachyonic.neutrino import mysql
+from tachyonic.neutrino.config import Config
+from tachyonic.neutrino.wsgi import Runtime
+from tachyonic.neutrino.wsgi import Wsgi
+
+log = logging.getLogger(__name__)
+
+
+class _Pre(object):
+    def pre(self, req, resp):
+        pass
+
+
+class _Post(object):
+    def post(self, req, resp):
+        pass
+
+
+class _Both(_Pre, _Post):
+    pass
+
+
+class TestRuntime(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def config(self, settings):
+        path = os.path.join(self.path, 'settings.cfg')
+        with open(path, 'w') as handle:
+            handle.write(settings)
+        return Config(path)
+
+    def test_middleware(self):
+        config = self.config("[application]\n[logging]\n")
+        first, second, third = _Pre(), _Post(), _Both()
+        runtime = Runtime(config, self.path, [first, second, third])
+        self.assertEqual(runtime.pre, (first.pre, third.pre))
+        self.assertEqual(runtime.post, (third.post, second.post))
+
+    def test_static(self):
+        config = self.config("[application]\nstatic = /static/\n" +
+                             "[logging]\n")
+        self.assertEqual(Runtime(config, self.path, []).static, '/static')
+        config = self.config("[application]\n[logging]\n")
+        self.assertEqual(Runtime(config, self.path, []).static, '')
+
+    @mock.patch('tachyonic.neutrino.wsgi.SessionFile')
+    def test_session_file(self, session_file):
+        config = self.config("[application]\n[logging]\n")
+        runtime = Runtime(config, self.path, [])
+        self.assertTrue(runtime.session() is session_file.return_value)
+        session_file.assert_called_once_with(config, app_root=self.path)
+
+    @mock.patch('tachyonic.neutrino.wsgi.redis')
+    @mock.patch('tachyonic.neutrino.wsgi.SessionRedis')
+    def test_session_redis(self, session_redis, redis):
+        config = self.config("[application]\n[logging]\n[redis]\n" +
+                             "host = localhost\n")
+        runtime = Runtime(config, self.path, [])
+        self.assertTrue(runtime.session() is session_redis.return_value)
+        session_redis.assert_called_once_with(config,
+                                              redis=redis.return_value)
+
+    def test_immutable(self):
+        config = self.config("[application]\n[logging]\ndebug = true\n")
+        runtime = Runtime(config, self.path, [])
+        self.assertTrue(runtime.debug)
+        self.assertIsNone(runtime.mysql)
+        self.assertRaises(AttributeError, setattr, runtime, 'debug', False)
+        self.assertRaises(AttributeError, setattr, runtime, 'other', 1)
+
+
+class TestFinish(unittest.TestCase):
+    def test_streamed_profile(self):
+        app = Wsgi()
+        req = mock.Mock(method='GET', profiler=mysql.profile_start())
+        session = mock.Mock()
+        # Query run by the streamed body after the headers were sent.
+        mysql._record("SELECT 1", 0.001, 1)
+        with mock.patch.object(app, '_cleanup') as cleanup:
+            app._finish(session, req)
+        self.assertIsNone(mysql.profile_stop())
+        self.assertEqual(req.profiler.summary()['queries'], 1)
+        cleanup.assert_called_once_with()
+        session.save.assert_called_once_with()